@@ -0,0 +1,110 @@
+import hashlib
+import logging
+import os
+import pandas as pd
+from xlsx_reader import read_excel
+
+# Bump when the way attachments are parsed changes, so stale entries are ignored
+CACHE_VERSION = 2
+
+logger = logging.getLogger(__name__)
+
+def _parquet_available():
+    """Check whether pandas can write Parquet (needs pyarrow or fastparquet)."""
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        pass
+    try:
+        import fastparquet  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+class AttachmentCache:
+    """
+    On-disk cache of parsed Excel attachments keyed by a hash of the raw bytes.
+    DataFrames are stored as Parquet when available (pickle otherwise), and the
+    least recently used entries are evicted once the cache exceeds max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.extension = '.parquet' if _parquet_available() else '.pkl'
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        return os.path.join(self.cache_dir, f"v{CACHE_VERSION}-{digest}{self.extension}")
+
+    def get(self, data):
+        """Return the cached DataFrame for these attachment bytes, or None."""
+        path = self._path(data)
+        try:
+            if self.extension == '.parquet':
+                df = pd.read_parquet(path)
+            else:
+                df = pd.read_pickle(path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("Ignoring unreadable cache entry %s: %s", path, e)
+            return None
+
+        # Refresh the modification time so eviction treats the entry as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return df
+
+    def put(self, data, df):
+        """Store a parsed DataFrame for these attachment bytes."""
+        path = self._path(data)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            if self.extension == '.parquet':
+                df.to_parquet(tmp_path, index=False)
+            else:
+                df.to_pickle(tmp_path)
+            # Atomic rename so concurrent workers never read a half-written file
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning("Could not cache attachment: %s", e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._evict()
+
+    def _evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        total_size = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_file() or entry.name.endswith('.tmp'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_size += stat.st_size
+
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+    def read_excel(self, data):
+        """Parse attachment bytes (fast broker reader or pd.read_excel) unless already cached."""
+        df = self.get(data)
+        if df is None:
+            df = read_excel(data)
+            self.put(data, df)
+        return df
@@ -0,0 +1,186 @@
+import argparse
+import glob
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+
+from attachment_cache import AttachmentCache
+from extract_trades import ingest_emails, sort_by_delivery
+from reconcile_trades import TradeReconciliation, MATCHING_MODES
+from trade_dedup import drop_restated
+from trade_schema import check_client_orders, concat_trades, to_matching_layout
+from instrumentation import configure_logging
+
+logger = logging.getLogger(__name__)
+
+# Matching never crosses these columns, so each (Date, Ticker) shard reconciles independently
+SHARD_KEYS = ['Date', 'Ticker']
+
+# Broker emails are named like 'Trade File BROKER 1 - 31_01_2025.eml'
+EMAIL_DATE_PATTERN = re.compile(r'(\d{2})_(\d{2})_(\d{4})')
+
+def email_file_date(path):
+    """Return the date in a broker email file name, or None if it has none."""
+    match = EMAIL_DATE_PATTERN.search(os.path.basename(path))
+    if not match:
+        return None
+    day, month, year = match.groups()
+    try:
+        return datetime(int(year), int(month), int(day)).date()
+    except ValueError:
+        return None
+
+def collect_email_paths(pattern=None, data_dir=None, start_date=None, end_date=None):
+    """
+    List the .eml files to reconcile, either matching a glob pattern or all
+    files in data_dir, optionally limited to file dates in [start_date, end_date].
+    """
+    if pattern is None:
+        pattern = os.path.join(data_dir or '.', '*.eml')
+    paths = sorted(glob.glob(pattern))
+
+    if start_date is not None or end_date is not None:
+        selected = []
+        for path in paths:
+            file_date = email_file_date(path)
+            if file_date is None:
+                logger.warning("Skipping %s: no date in file name", path)
+                continue
+            if start_date is not None and file_date < start_date:
+                continue
+            if end_date is not None and file_date > end_date:
+                continue
+            selected.append(path)
+        paths = selected
+
+    return paths
+
+def _shard_buckets(df, n_shards):
+    """
+    Shard bucket of each row. Matching compares dates by value, but their hash
+    depends on the datetime unit (pd.read_excel and xlsx_reader may differ), so
+    dates are hashed in one unit.
+    """
+    keys = df[SHARD_KEYS]
+    if pd.api.types.is_datetime64_any_dtype(keys['Date']):
+        keys = keys.assign(Date=keys['Date'].dt.as_unit('ns'))
+    return pd.util.hash_pandas_object(keys, index=False).to_numpy() % n_shards
+
+def shard_frames(client_orders, broker_trades, n_shards):
+    """
+    Split orders and trades into n_shards buckets by hashing (Date, Ticker).
+    Every order lands in the same bucket as all trades it could match.
+    Yields (orders, trades) per non-empty bucket.
+    """
+    order_bucket = _shard_buckets(client_orders, n_shards)
+    trade_bucket = _shard_buckets(broker_trades, n_shards)
+
+    for bucket in range(n_shards):
+        orders = client_orders[order_bucket == bucket]
+        if orders.empty:
+            continue
+        yield orders, broker_trades[trade_bucket == bucket]
+
+def _to_global_rows(result, orders, trades):
+    """Map the order_row/trade_row positions of a shard result to positions in the unsharded frames."""
+    for column, frame in (('order_row', orders), ('trade_row', trades)):
+        if column in result.columns:
+            result[column] = frame.index.to_numpy()[result[column].to_numpy(dtype=int)]
+    return result
+
+def _reconcile_shard(args):
+    """Reconcile one shard in a worker process."""
+    orders, trades, mode = args
+    reconciler = TradeReconciliation(orders, trades, mode=mode)
+    reconciler.reconcile()
+    return reconciler.get_results()
+
+def reconcile_sharded(client_orders, broker_trades, n_shards=None, max_workers=None, mode='vectorized'):
+    """
+    Reconcile client orders against broker trades across processes, one
+    (Date, Ticker) shard bucket per task, and merge the results.
+    Rows keep their relative order within a shard but are grouped by shard.
+    """
+    if mode not in MATCHING_MODES:
+        raise ValueError(f"Batch reconciliation supports modes {MATCHING_MODES}, not {mode}")
+
+    n_shards = n_shards or (max_workers or os.cpu_count() or 1) * 4
+    # Positional indexes let order_row/trade_row be mapped back from the shards
+    client_orders = client_orders.reset_index(drop=True)
+    broker_trades = broker_trades.reset_index(drop=True)
+    tasks = [(orders, trades, mode) for orders, trades in shard_frames(client_orders, broker_trades, n_shards)]
+    logger.info("Reconciling %d orders in %d shards", len(client_orders), len(tasks))
+
+    if max_workers == 1 or len(tasks) <= 1:
+        shard_results = [_reconcile_shard(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            shard_results = list(executor.map(_reconcile_shard, tasks))
+    shard_results = [{name: _to_global_rows(df, orders, trades) for name, df in result.items()}
+                     for (orders, trades, _), result in zip(tasks, shard_results)]
+
+    merged = {}
+    for name in ('matched', 'unmatched', 'excess'):
+        frames = [result[name] for result in shard_results if not result[name].empty]
+        if frames:
+            merged[name] = concat_trades(frames, ignore_index=True)
+        else:
+            # Keep the column layout of an empty shard result when nothing matched
+            merged[name] = shard_results[0][name] if shard_results else pd.DataFrame()
+    return merged
+
+def run_batch(email_paths, output_dir, n_shards=None, max_workers=None, mode='vectorized', cache=None):
+    """Ingest a batch of emails, reconcile them sharded and write the merged results."""
+    # Delivery order, so a restated file comes after the file it replaces
+    client_orders, broker_trades = ingest_emails(sort_by_delivery(email_paths), max_workers=max_workers, cache=cache)
+    broker_trades = drop_restated(broker_trades)
+    if client_orders is None or not broker_trades:
+        logger.warning("Need both client orders and broker trades to reconcile. Exiting batch.")
+        return None
+
+    try:
+        check_client_orders(client_orders)
+        matching_trades = to_matching_layout(concat_trades(broker_trades, ignore_index=True))
+    except ValueError as e:
+        logger.error("Cannot reconcile batch: %s", e)
+        return None
+
+    results = reconcile_sharded(client_orders, matching_trades, n_shards, max_workers, mode)
+
+    os.makedirs(output_dir, exist_ok=True)
+    for name, df in results.items():
+        output_path = os.path.join(output_dir, f'reconciliation_{name}.csv')
+        df.to_csv(output_path, index=False)
+        logger.info("Generated %s results: %s (%d rows)", name, output_path, len(df))
+    return results
+
+def _parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+def main():
+    parser = argparse.ArgumentParser(description='Reconcile many days of broker emails sharded across cores.')
+    parser.add_argument('--glob', dest='pattern', default=None, help="glob of .eml files, e.g. 'data/*_2025.eml'")
+    parser.add_argument('--data-dir', default='data', help='directory of .eml files when --glob is not given')
+    parser.add_argument('--start', type=_parse_date, default=None, help='first file date (YYYY-MM-DD)')
+    parser.add_argument('--end', type=_parse_date, default=None, help='last file date (YYYY-MM-DD)')
+    parser.add_argument('--output-dir', default='Reports', help='directory for the merged results')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes')
+    parser.add_argument('--shards', type=int, default=None, help='number of (Date, Ticker) shard buckets')
+    parser.add_argument('--mode', choices=MATCHING_MODES, default='vectorized')
+    args = parser.parse_args()
+
+    configure_logging()
+    email_paths = collect_email_paths(args.pattern, args.data_dir, args.start, args.end)
+    if not email_paths:
+        logger.warning("No email files selected.")
+        return
+
+    cache = AttachmentCache(os.path.join(os.path.dirname(email_paths[0]), '.attachment_cache'))
+    run_batch(email_paths, args.output_dir, args.shards, args.workers, args.mode, cache)
+
+if __name__ == "__main__":
+    main()
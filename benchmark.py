@@ -0,0 +1,159 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+from extract_trades import ingest_emails
+from reconcile_trades import TradeReconciliation, RECONCILIATION_MODES
+from report_generation import calculate_costs, generate_broker_summary
+from synthetic_data import generate_broker_trades, generate_client_orders, write_trade_emails, _excel_bytes
+from trade_schema import concat_trades, to_matching_layout
+from xlsx_reader import read_broker_xlsx
+
+def _git_revision():
+    """Return the current git commit, or None outside a git checkout."""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def measure(name, func, repeat=1, memory=True):
+    """
+    Time func over repeat runs (best run reported) and, if memory is set,
+    measure its peak traced allocation in one extra run under tracemalloc.
+    Timing runs are not traced, since tracemalloc slows allocation-heavy code.
+    Only allocations in this process are traced, not in extraction workers.
+    Returns (result of the last run, stage record).
+    """
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+
+    peak_mb = None
+    if memory:
+        tracemalloc.start()
+        try:
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        peak_mb = round(peak / (1024 * 1024), 3)
+
+    record = {
+        'stage': name,
+        'seconds': round(min(timings), 6),
+        'seconds_all': [round(t, 6) for t in timings],
+        'peak_memory_mb': peak_mb,
+    }
+    print(f"{name:<28} {record['seconds']:>10.4f}s" + (f" {peak_mb:>10.1f} MB" if peak_mb is not None else ''))
+    return result, record
+
+def run_benchmarks(n_trades, n_brokers=3, n_instruments=500, n_days=1, modes=('vectorized',),
+                   max_workers=None, repeat=1, memory=True, seed=0, work_dir=None):
+    """Generate synthetic broker emails and benchmark each pipeline stage on them."""
+    work_dir = work_dir or tempfile.mkdtemp(prefix='trade_benchmark_')
+    data_dir = os.path.join(work_dir, 'data')
+    output_dir = os.path.join(work_dir, 'Reports')
+    os.makedirs(output_dir, exist_ok=True)
+
+    print(f"Generating {n_trades} trades for {n_brokers} brokers in {work_dir}...")
+    broker_frames = generate_broker_trades(n_trades, n_brokers, n_instruments, n_days, seed=seed)
+    matching_trades = to_matching_layout(pd.concat(broker_frames, ignore_index=True))
+    client_orders = generate_client_orders(matching_trades, seed=seed)
+    email_paths = write_trade_emails(broker_frames, data_dir)
+
+    stages = []
+
+    # Attachment decoding alone, pd.read_excel against the raw-XML broker reader
+    attachment = _excel_bytes(broker_frames[0])
+    for name, decode in (('read_excel', lambda: pd.read_excel(BytesIO(attachment))),
+                         ('xlsx_reader', lambda: read_broker_xlsx(attachment))):
+        _, record = measure(f'decode[{name}]', decode, repeat, memory)
+        stages.append(record)
+
+    broker_trades, record = measure(
+        'extract', lambda: ingest_emails(email_paths, max_workers=max_workers)[1], repeat, memory
+    )
+    stages.append(record)
+
+    combined, record = measure('concat', lambda: concat_trades(broker_trades), repeat, memory)
+    stages.append(record)
+
+    costed, record = measure('calculate_costs', lambda: calculate_costs(combined.copy()), repeat, memory)
+    stages.append(record)
+
+    for mode in modes:
+        def reconcile(mode=mode):
+            reconciler = TradeReconciliation(client_orders, matching_trades, mode=mode,
+                                             state_db=os.path.join(work_dir, f'state_{time.time_ns()}.db'))
+            reconciler.reconcile()
+            return reconciler
+        _, record = measure(f'reconcile[{mode}]', reconcile, repeat, memory)
+        stages.append(record)
+
+    _, record = measure('generate_broker_summary', lambda: generate_broker_summary(costed, output_dir), repeat, memory)
+    stages.append(record)
+
+    return {
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'git_revision': _git_revision(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'parameters': {
+            'trades': n_trades,
+            'brokers': n_brokers,
+            'instruments': n_instruments,
+            'days': n_days,
+            'client_orders': len(client_orders),
+            'modes': list(modes),
+            'max_workers': max_workers,
+            'repeat': repeat,
+            'seed': seed,
+        },
+        'stages': stages,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the trade reconciliation pipeline on synthetic data.')
+    parser.add_argument('--trades', type=int, default=100000, help='number of broker fills to generate')
+    parser.add_argument('--brokers', type=int, default=3, help='number of brokers (one email each)')
+    parser.add_argument('--instruments', type=int, default=500, help='number of distinct ISINs')
+    parser.add_argument('--days', type=int, default=1, help='number of deal dates to spread trades over')
+    parser.add_argument('--modes', nargs='+', default=['vectorized'], choices=RECONCILIATION_MODES,
+                        help='reconciliation modes to benchmark (loop is O(orders x trades))')
+    parser.add_argument('--workers', type=int, default=None, help='process pool size for extraction')
+    parser.add_argument('--repeat', type=int, default=1, help='timing runs per stage; the best is reported')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc peak memory runs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work-dir', default=None, help='where to write generated emails and reports')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON file for the results')
+    args = parser.parse_args()
+
+    results = run_benchmarks(
+        args.trades, args.brokers, args.instruments, args.days, args.modes,
+        args.workers, args.repeat, not args.no_memory, args.seed, args.work_dir
+    )
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nBenchmark results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import logging
+import numpy as np
+import pandas as pd
+from instrumentation import timed
+
+logger = logging.getLogger(__name__)
+
+BPS = 10_000
+
+BROKER_COLUMN = 'party code/SEBI regn code of party'
+
+# Columns of the broker trade files the per-trade metrics are computed from
+TRADE_PRICE_COLUMNS = ['QTY', 'COST', 'NET AMOUNT', 'Brokerage Amount', 'STT']
+
+# +1 when a higher price costs the client (buys), -1 when it benefits them (sells)
+SIDE_SIGNS = {'B': 1.0, 'BUY': 1.0, 'S': -1.0, 'SELL': -1.0}
+
+FILL_COLUMNS = [
+    'order_id', 'trade_id', 'broker_id', 'symbol', 'side', 'matched_quantity', 'execution_price', 'net_price',
+    'order_price', 'fill_value', 'explicit_cost', 'cost_bps', 'slippage_bps', 'all_in_bps'
+]
+
+DEFAULT_PERCENTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+def _side_signs(series):
+    """Map a Buy/Sell column to +1/-1 (NaN if unknown), once per category for categoricals."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        lookup = np.array([SIDE_SIGNS.get(str(c).strip().upper(), np.nan) for c in series.cat.categories] + [np.nan])
+        return lookup[codes]  # code -1 (missing) picks the trailing NaN
+    return series.astype(str).str.strip().str.upper().map(SIDE_SIGNS).to_numpy(dtype=float)
+
+def _divide(numerator, denominator):
+    """Elementwise division that yields NaN instead of warnings for zero denominators."""
+    numerator = np.asarray(numerator, dtype=float)
+    denominator = np.asarray(denominator, dtype=float)
+    out = np.full(np.broadcast(numerator, denominator).shape, np.nan)
+    np.divide(numerator, denominator, out=out, where=denominator != 0)
+    return out
+
+def _take(values, positions):
+    """Index values by positions from get_indexer; -1 (not found) gives NaN."""
+    values = np.asarray(values)
+    if values.dtype.kind != 'f':
+        values = values.astype(object)
+    return np.append(values, np.nan)[positions]
+
+def _column(df, *names, default=np.nan):
+    for name in names:
+        if name in df.columns:
+            return df[name]
+    return pd.Series(default, index=df.index)
+
+@timed('cost_analytics.trades')
+def add_trade_costs(broker_trades_df):
+    """
+    Add per-trade cost metrics to broker trades in the broker file layout:
+    Gross Value (QTY x COST), Net Price (NET AMOUNT / QTY), Cost bps (brokerage
+    and STT over gross value) and Fee bps (net over gross price, signed by side).
+    """
+    quantity = broker_trades_df['QTY'].to_numpy(dtype=float)
+    price = broker_trades_df['COST'].to_numpy(dtype=float)
+    explicit = broker_trades_df['Brokerage Amount'].to_numpy(dtype=float) + broker_trades_df['STT'].to_numpy(dtype=float)
+    gross_value = quantity * price
+    net_price = _divide(broker_trades_df['NET AMOUNT'].to_numpy(dtype=float), quantity)
+    sign = _side_signs(broker_trades_df['Buy/Sell Flag'])
+
+    return broker_trades_df.assign(**{
+        'Gross Value': gross_value,
+        'Net Price': net_price,
+        'Cost bps': _divide(explicit, np.abs(gross_value)) * BPS,
+        'Fee bps': sign * _divide(net_price - price, price) * BPS,
+    })
+
+def _positions(fills, row_column, id_column, frame):
+    """
+    Positions of the fills' orders or trades in frame: the order_row/trade_row
+    the matching engines record, or a UCC lookup for fills without them, which
+    needs the UCC to be unique. -1 where the fill has no row.
+    """
+    if row_column in fills.columns:
+        return pd.to_numeric(fills[row_column]).fillna(-1).to_numpy(dtype=int)
+    if frame['UCC'].duplicated().any():
+        raise ValueError(f"Cannot look up fills by {id_column}: UCC is not unique. "
+                         f"Pass fills with the {row_column} column from the matching engine.")
+    return pd.Index(frame['UCC']).get_indexer(fills[id_column])
+
+@timed('cost_analytics.fills')
+def fill_costs(fills, broker_trades, client_orders):
+    """
+    Cost each reconciliation fill (matched or excess rows) against its order.
+    Trades and orders are found by the fills' trade_row/order_row, positions
+    in the broker_trades and client_orders that were reconciled. Execution price
+    is the trade COST, net price NET AMOUNT per unit and order price the order's
+    Price column if it has one. Explicit costs are pro-rated to the filled
+    quantity. Slippage is in bps of the order price, positive when the client
+    paid more (bought higher or sold lower) than the order price.
+    """
+    trades = broker_trades.reset_index(drop=True)
+    orders = client_orders.reset_index(drop=True)
+    trade_pos = _positions(fills, 'trade_row', 'trade_id', trades)
+    order_pos = _positions(fills, 'order_row', 'order_id', orders)
+    if (trade_pos < 0).any():
+        logger.warning("%d fills reference unknown trades", int((trade_pos < 0).sum()))
+
+    trade_quantity = _take(_column(trades, 'QTY', 'Quantity').to_numpy(dtype=float), trade_pos)
+    execution_price = _take(_column(trades, 'COST', 'Price').to_numpy(dtype=float), trade_pos)
+    net_amount = _take(_column(trades, 'NET AMOUNT', 'Net Amount').to_numpy(dtype=float), trade_pos)
+    trade_cost = _take((trades['Brokerage Amount'] + trades['STT']).to_numpy(dtype=float), trade_pos)
+    order_price = _take(_column(orders, 'Price').to_numpy(dtype=float), order_pos)
+    side = _take(_column(trades, 'Direction', 'Buy/Sell Flag').astype(object).to_numpy(), trade_pos)
+    broker = _take(_column(trades, BROKER_COLUMN).astype(object).to_numpy(), trade_pos)
+
+    quantity = fills['matched_quantity'].to_numpy(dtype=float)
+    sign = _side_signs(pd.Series(side, dtype=object))
+    net_price = _divide(net_amount, trade_quantity)
+    fill_value = quantity * execution_price
+    explicit_cost = trade_cost * _divide(quantity, trade_quantity)
+
+    return pd.DataFrame({
+        'order_id': fills['order_id'].to_numpy(),
+        'trade_id': fills['trade_id'].to_numpy(),
+        'broker_id': broker,
+        'symbol': fills['symbol'].to_numpy(),
+        'side': side,
+        'matched_quantity': quantity,
+        'execution_price': execution_price,
+        'net_price': net_price,
+        'order_price': order_price,
+        'fill_value': fill_value,
+        'explicit_cost': explicit_cost,
+        'cost_bps': _divide(explicit_cost, np.abs(fill_value)) * BPS,
+        'slippage_bps': sign * _divide(execution_price - order_price, order_price) * BPS,
+        'all_in_bps': sign * _divide(net_price - order_price, order_price) * BPS,
+    }, columns=FILL_COLUMNS)
+
+@timed('cost_analytics.orders')
+def order_costs(fill_costs_df):
+    """
+    Aggregate costed fills per order: filled quantity, VWAP and net VWAP,
+    explicit cost, and slippage of the VWAP against the order price.
+    """
+    codes, order_ids = pd.factorize(fill_costs_df['order_id'], sort=False)
+    n = len(order_ids)
+    valid = codes >= 0
+    codes = codes[valid]
+    df = fill_costs_df[valid]
+
+    def _sum(values):
+        return np.bincount(codes, weights=np.nan_to_num(np.asarray(values, dtype=float)), minlength=n)
+
+    quantity = df['matched_quantity'].to_numpy(dtype=float)
+    filled = _sum(quantity)
+    value = _sum(df['fill_value'])
+    net_value = _sum(quantity * df['net_price'].to_numpy(dtype=float))
+    explicit_cost = _sum(df['explicit_cost'])
+
+    # Order attributes are the same on every fill of the order
+    _, first = np.unique(codes, return_index=True)
+    order_price = df['order_price'].to_numpy(dtype=float)[first]
+    sign = _side_signs(pd.Series(df['side'].to_numpy()[first], dtype=object))
+
+    vwap = _divide(value, filled)
+    net_vwap = _divide(net_value, filled)
+    return pd.DataFrame({
+        'order_id': order_ids,
+        'fills': np.bincount(codes, minlength=n),
+        'filled_quantity': filled,
+        'vwap': vwap,
+        'net_vwap': net_vwap,
+        'order_price': order_price,
+        'explicit_cost': explicit_cost,
+        'cost_bps': _divide(explicit_cost, np.abs(value)) * BPS,
+        'slippage_bps': sign * _divide(vwap - order_price, order_price) * BPS,
+        'all_in_bps': sign * _divide(net_vwap - order_price, order_price) * BPS,
+    })
+
+@timed('cost_analytics.distribution')
+def broker_cost_distribution(df, value_column='Cost bps', broker_column=BROKER_COLUMN,
+                             percentiles=DEFAULT_PERCENTILES):
+    """
+    Distribution of a per-fill cost metric by broker: count, mean, standard
+    deviation and the given percentiles, one row per broker.
+    """
+    grouped = df.groupby(broker_column, sort=True, observed=True)[value_column]
+    stats = grouped.agg(['count', 'mean', 'std', 'min', 'max'])
+    quantiles = grouped.quantile(list(percentiles)).unstack()
+    quantiles.columns = [f'p{round(q * 100):02d}' for q in quantiles.columns]
+
+    result = stats.join(quantiles).reset_index().rename(columns={broker_column: 'broker_id'})
+    result.insert(1, 'metric', value_column)
+    return result
@@ -1,10 +1,17 @@
-import pandas as pd
 from datetime import datetime
 import email
+import logging
 import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from email import policy
 from email.parser import BytesParser
-from io import BytesIO  # Import BytesIO for handling byte streams
+from xlsx_reader import read_excel
+from trade_schema import normalize_broker_trades, normalize_client_orders, concat_trades
+from instrumentation import RunMetrics, activate, configure_logging, count, get_metrics, timer
+
+logger = logging.getLogger(__name__)
 
 def identify_file_type(filename, df):
     """
@@ -12,102 +19,135 @@ def identify_file_type(filename, df):
     based on filename and/or content.
     """
     filename_lower = filename.lower()
-    print(f"Identifying file type for: {filename}")
+    logger.debug("Identifying file type for: %s", filename)
 
     # Check if the filename indicates client orders
     if 'client' in filename_lower or 'order' in filename_lower:
-        print("Identified as client orders based on filename.")
+        logger.debug("Identified as client orders based on filename.")
         return 'client_orders'
     
     # Check if the filename indicates broker trades
     elif 'broker' in filename_lower or 'trade' in filename_lower:
-        print("Identified as broker trades based on filename.")
+        logger.debug("Identified as broker trades based on filename.")
         return 'broker_trades'
     
     # If filename is not conclusive, try to identify by columns
     columns = set(df.columns.str.lower())
-    print(f"Columns found: {columns}")
+    logger.debug("Columns found: %s", columns)
 
     # Check for specific identifiers for broker trades
     if 'buy/sell flag' in columns and 'qty' in columns:
-        print("Identified as broker trades based on column names.")
+        logger.debug("Identified as broker trades based on column names.")
         return 'broker_trades'
     
     # Default to broker trades if we can't determine
-    print("Defaulting to broker trades.")
+    logger.debug("Defaulting to broker trades.")
     return 'broker_trades'
 
-def extract_excel_from_email(email_path):
+def extract_excel_from_email(email_path, cache=None):
     """
     Extract all Excel attachments from a single email file.
+    If an AttachmentCache is given, unchanged attachments are loaded from it.
     Returns tuple of (client_orders, broker_trades).
     """
     client_orders = []
     broker_trades = []
     
     try:
-        print(f"\nProcessing email file: {email_path}")
+        logger.debug("Processing email file: %s", email_path)
         if not os.path.exists(email_path):
-            print(f"File not found: {email_path}")
+            logger.warning("File not found: %s", email_path)
             return None, None
             
-        with open(email_path, 'rb') as f:
-            msg = BytesParser(policy=policy.default).parse(f)
+        with timer('mime_parse'):
+            with open(email_path, 'rb') as f:
+                msg = BytesParser(policy=policy.default).parse(f)
+        count('emails')
             
-            # Process each attachment in the email
-            for part in msg.walk():
-                if part.get_content_maintype() == 'multipart':
-                    continue
-                if part.get('Content-Disposition') is None:
-                    continue
-                    
-                filename = part.get_filename()
-                if filename and filename.lower().endswith(('.xlsx', '.xls')):
-                    print(f"Found Excel attachment: {filename}")
-                    # Extract the Excel file content
+        # Process each attachment in the email
+        for part in msg.walk():
+            if part.get_content_maintype() == 'multipart':
+                continue
+            if part.get('Content-Disposition') is None:
+                continue
+                
+            filename = part.get_filename()
+            if filename and filename.lower().endswith(('.xlsx', '.xls')):
+                logger.debug("Found Excel attachment: %s", filename)
+                # Extract the Excel file content
+                with timer('mime_parse'):
                     excel_data = part.get_payload(decode=True)
-                    # Read into DataFrame using BytesIO
-                    df = pd.read_excel(BytesIO(excel_data))
-                    print(f"Loaded file with columns: {df.columns.tolist()}")
-                    
-                    # Identify file type
-                    file_type = identify_file_type(filename, df)
-                    if file_type == 'client_orders':
-                        client_orders.append(df)
-                        print("Client orders appended.")
+                # Read into a DataFrame (fast path for broker files), or from the cache if seen before
+                with timer('excel_decode'):
+                    if cache is not None:
+                        df = cache.read_excel(excel_data)
                     else:
-                        broker_trades.append(df)
-                        print("Broker trades appended.")
+                        df = read_excel(excel_data)
+                count('attachments')
+                logger.debug("Loaded file with columns: %s", df.columns.tolist())
+                
+                # Identify file type
+                file_type = identify_file_type(filename, df)
+                if file_type == 'client_orders':
+                    client_orders.append(normalize_client_orders(df))
+                    count('client_order_rows', len(df))
+                else:
+                    broker_trades.append(normalize_broker_trades(df))
+                    count('broker_trade_rows', len(df))
         
         return client_orders, broker_trades
         
-    except Exception as e:
-        print(f"Error processing email file: {str(e)}")
-        import traceback
-        print(traceback.format_exc())
+    except Exception:
+        logger.exception("Error processing email file: %s", email_path)
         return None, None
 
-def load_client_orders():
+def email_delivery_time(email_path):
+    """
+    When an email was sent, as a POSIX timestamp from its Date header, or
+    the file's modification time if it has no usable Date header.
+    """
+    try:
+        with open(email_path, 'rb') as f:
+            header_lines = []
+            for line in f:
+                if line in (b'\r\n', b'\n'):
+                    break
+                header_lines.append(line)
+        sent = BytesParser(policy=policy.default).parsebytes(b''.join(header_lines), headersonly=True)['Date']
+        if sent is not None and sent.datetime is not None:
+            return sent.datetime.timestamp()
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        logger.debug("No usable Date header in %s: %s", email_path, e)
+    return os.path.getmtime(email_path)
+
+def sort_by_delivery(email_paths):
+    """Order email files by when they were sent, so later files can restate earlier ones."""
+    return sorted(email_paths, key=lambda path: (email_delivery_time(path), path))
+
+def _extract_in_worker(email_path, cache=None):
+    """
+    Run extract_excel_from_email in a pool worker and return its timers and
+    counters with the result, since the worker's metrics are otherwise lost.
+    """
+    with activate(RunMetrics()) as metrics:
+        result = extract_excel_from_email(email_path, cache=cache)
+    return result, metrics.to_dict()
+
+def load_client_orders(email_paths):
     """Load client orders from email attachments."""
     all_client_orders = []
-    email_paths = [
-        r'C:\Users\Sankalp\Desktop\trade_reconciliation\data\Trade File BROKER 1 - 31_01_2025.eml',
-        r'C:\Users\Sankalp\Desktop\trade_reconciliation\data\Trade File BROKER 2 - 31_01_2025.eml',
-        r'C:\Users\Sankalp\Desktop\trade_reconciliation\data\Trade File BROKER 3 - 31_01_2025.eml'
-    ]
-    
     for path in email_paths:
         client_orders, _ = extract_excel_from_email(path)
         if client_orders:
             all_client_orders.extend(client_orders)
-            print(f"Loaded {len(client_orders)} client orders from {path}.")
+            logger.info("Loaded %d client orders from %s.", len(client_orders), path)
         else:
-            print(f"No client orders found in {path}.")
+            logger.info("No client orders found in %s.", path)
     
     if all_client_orders:
-        return pd.concat(all_client_orders, ignore_index=True)
+        return concat_trades(all_client_orders, ignore_index=True)
     
-    print("No client orders found after processing all emails.")
+    logger.warning("No client orders found after processing all emails.")
     return None
 
 def extract_broker_files(email_paths):
@@ -121,18 +161,72 @@ def extract_broker_files(email_paths):
     
     return all_broker_trades
 
+def ingest_emails(email_paths, max_workers=None, cache=None):
+    """
+    Parse every email once and return client orders and broker trades together.
+    MIME decoding and Excel parsing are fanned out across a process pool;
+    max_workers=1 parses in the current process. An optional AttachmentCache
+    skips Excel parsing for attachments that were parsed in an earlier run.
+    Returns tuple of (client_orders DataFrame or None, list of broker trade DataFrames).
+    """
+    all_client_orders = []
+    all_broker_trades = []
+
+    if max_workers == 1 or len(email_paths) <= 1:
+        results = [extract_excel_from_email(path, cache=cache) for path in email_paths]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            # map keeps results in the same order as email_paths
+            results = []
+            for result, worker_metrics in executor.map(partial(_extract_in_worker, cache=cache), email_paths):
+                results.append(result)
+                get_metrics().merge(worker_metrics)
+
+    for path, (client_orders, broker_trades) in zip(email_paths, results):
+        if client_orders:
+            all_client_orders.extend(client_orders)
+            logger.info("Loaded %d client orders from %s.", len(client_orders), path)
+        if broker_trades:
+            all_broker_trades.extend(broker_trades)
+
+    if all_client_orders:
+        return concat_trades(all_client_orders, ignore_index=True), all_broker_trades
+
+    return None, all_broker_trades
+
+def iter_broker_frames(email_paths, cache=None):
+    """Yield the broker trade DataFrames of email_paths one attachment at a time."""
+    for path in email_paths:
+        _, broker_trades = extract_excel_from_email(path, cache=cache)
+        while broker_trades:
+            yield broker_trades.pop(0)
+
+def iter_broker_trade_chunks(email_paths, chunk_size, cache=None, drop=None):
+    """
+    Yield broker trades in DataFrames of at most chunk_size rows.
+    Emails are processed one at a time, so only one attachment is held in
+    memory at once instead of the whole day's trades. drop optionally holds
+    one boolean mask per broker frame of the rows to leave out (see
+    trade_dedup.restated_rows).
+    """
+    for i, df in enumerate(iter_broker_frames(email_paths, cache=cache)):
+        if drop is not None and drop[i].any():
+            df = df[~drop[i]]
+        for start in range(0, len(df), chunk_size):
+            yield df.iloc[start:start + chunk_size].copy()
+        del df
+
 if __name__ == "__main__":
+    configure_logging()
+
     # Test the functions
     print("Testing data extraction...")
     
-    email_paths = [
-        r'C:\Users\Sankalp\Desktop\trade_reconciliation\data\Trade File BROKER 1 - 31_01_2025.eml',
-        r'C:\Users\Sankalp\Desktop\trade_reconciliation\data\Trade File BROKER 2 - 31_01_2025.eml',
-        r'C:\Users\Sankalp\Desktop\trade_reconciliation\data\Trade File BROKER 3 - 31_01_2025.eml'
-    ]
+    from run_reconciliation import find_email_paths
+    email_paths = find_email_paths(sys.argv[1] if len(sys.argv) > 1 else 'data')
     
     print("\nLoading client orders...")
-    client_orders = load_client_orders()
+    client_orders = load_client_orders(email_paths)
     
     if client_orders is not None:
         print("Client orders loaded successfully:")
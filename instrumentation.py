@@ -0,0 +1,149 @@
+import cProfile
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+def configure_logging(level=logging.INFO):
+    """Set up logging for the command line entry points."""
+    logging.basicConfig(level=level, format=LOG_FORMAT)
+
+class RunMetrics:
+    """
+    Timers and counters for one pipeline run, with optional cProfile and
+    tracemalloc hooks that are enabled between start() and stop().
+    """
+
+    def __init__(self, profile=False, trace_memory=False):
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.timers = {}  # name -> {'seconds': float, 'calls': int}
+        self.counters = {}
+        self.started_at = None
+        self.finished_at = None
+        self.peak_memory_mb = None
+        self._profiler = None
+        self._lock = threading.Lock()  # reports may be written from several threads
+
+    @contextmanager
+    def timer(self, name):
+        """Add the wall-clock time of the with-block to the named timer."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds, calls=1):
+        with self._lock:
+            entry = self.timers.setdefault(name, {'seconds': 0.0, 'calls': 0})
+            entry['seconds'] += seconds
+            entry['calls'] += calls
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    def merge(self, metrics):
+        """Fold in timers and counters from another run's to_dict(), e.g. from a worker process."""
+        for name, entry in metrics.get('timers', {}).items():
+            self.add_time(name, entry['seconds'], entry['calls'])
+        for name, value in metrics.get('counters', {}).items():
+            self.count(name, value)
+
+    def start(self):
+        self.started_at = datetime.now()
+        if self.profile:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stop(self):
+        self.finished_at = datetime.now()
+        if self._profiler is not None:
+            self._profiler.disable()
+        if self.trace_memory and tracemalloc.is_tracing():
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.peak_memory_mb = round(peak / (1024 * 1024), 3)
+
+    def to_dict(self):
+        duration = None
+        if self.started_at and self.finished_at:
+            duration = (self.finished_at - self.started_at).total_seconds()
+        return {
+            'started_at': self.started_at.isoformat(timespec='seconds') if self.started_at else None,
+            'finished_at': self.finished_at.isoformat(timespec='seconds') if self.finished_at else None,
+            'duration_seconds': duration,
+            'peak_memory_mb': self.peak_memory_mb,
+            'timers': {name: dict(entry) for name, entry in self.timers.items()},
+            'counters': dict(self.counters),
+        }
+
+    def write(self, output_dir):
+        """
+        Write run_metrics_<timestamp>.json into output_dir, plus the cProfile
+        stats as run_profile_<timestamp>.prof when profiling was enabled.
+        Returns the path of the metrics file.
+        """
+        stamp = (self.started_at or datetime.now()).strftime('%Y%m%d_%H%M%S')
+        metrics = self.to_dict()
+
+        if self._profiler is not None:
+            profile_path = os.path.join(output_dir, f'run_profile_{stamp}.prof')
+            self._profiler.dump_stats(profile_path)
+            metrics['profile_path'] = profile_path
+
+        metrics_path = os.path.join(output_dir, f'run_metrics_{stamp}.json')
+        with open(metrics_path, 'w') as f:
+            json.dump(metrics, f, indent=2)
+        logger.info("Run metrics written to %s", metrics_path)
+        return metrics_path
+
+# Metrics of the run in progress; a throwaway default lets instrumented code run standalone
+_active_metrics = RunMetrics()
+
+def get_metrics():
+    """Return the metrics of the run in progress."""
+    return _active_metrics
+
+@contextmanager
+def activate(metrics):
+    """Make metrics the active run for the with-block, starting and stopping its hooks."""
+    global _active_metrics
+    previous = _active_metrics
+    _active_metrics = metrics
+    metrics.start()
+    try:
+        yield metrics
+    finally:
+        metrics.stop()
+        _active_metrics = previous
+
+def timer(name):
+    """Time a with-block on the active run."""
+    return _active_metrics.timer(name)
+
+def count(name, n=1):
+    """Increment a counter on the active run."""
+    _active_metrics.count(name, n)
+
+def timed(name):
+    """Decorator that times every call of the function on the active run."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
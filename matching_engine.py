@@ -0,0 +1,469 @@
+import heapq
+import numpy as np
+import pandas as pd
+
+# Columns that identify which broker trades can fill a client order
+MATCH_KEYS = ['Ticker', 'Direction', 'Date']
+
+# order_row and trade_row are the positions of the order and trade in the frames
+# that were reconciled (None when there is none); order_id and trade_id are UCCs,
+# which need not be unique. execution_slippage is deprecated: it is the trade's
+# net price per unit (Net Amount / Quantity), reported as net_price by
+# cost_analytics.fill_costs, where slippage against the order price is slippage_bps.
+MATCH_COLUMNS = [
+    'order_id', 'trade_id', 'symbol', 'matched_quantity', 'status',
+    'brokerage_cost', 'stt', 'total_cost', 'execution_slippage', 'order_row', 'trade_row'
+]
+PENDING_COLUMNS = ['order_id', 'symbol', 'quantity', 'status', 'order_row']
+ROW_COLUMNS = ['order_row', 'trade_row']
+
+
+def _allocate_loop(order_quantity, trade_quantities):
+    """
+    Scalar allocation identical to TradeReconciliation._process_matches.
+    Used for groups the cumulative-sum path cannot handle (negative or
+    missing quantities). Returns (full_fills, excess_fills) where full_fills
+    are trade positions and excess_fills are (trade position, remaining).
+    """
+    full_fills = []
+    excess_fills = []
+    total_matched = 0
+
+    for position, trade_quantity in enumerate(trade_quantities):
+        if total_matched >= order_quantity:
+            break
+
+        if trade_quantity + total_matched <= order_quantity:
+            full_fills.append(position)
+            total_matched += trade_quantity
+        else:
+            remaining_needed = order_quantity - total_matched
+            excess_fills.append((position, remaining_needed))
+            total_matched += remaining_needed
+
+    return full_fills, excess_fills
+
+
+def _allocate_group(order_quantities, trade_quantities):
+    """
+    Allocate one (Ticker, Direction, Date) group with cumulative sums.
+
+    Every order sees all trades of its group in broker row order, just like
+    the row loop. For non-negative quantities the running total is monotonic,
+    so the fills of an order are a prefix of the group found by binary search:
+    a trade is looked at while the quantity before it is below the order
+    quantity, and fills completely while the quantity after it still fits.
+    Returns group-relative arrays (order, trade) for full fills and
+    (order, trade, remaining) for excess fills.
+    """
+    cumulative = np.cumsum(trade_quantities)
+    before = cumulative - trade_quantities
+
+    n_seen = np.searchsorted(before, order_quantities, side='left')
+    n_full = np.minimum(np.searchsorted(cumulative, order_quantities, side='right'), n_seen)
+
+    # Full fills: trades 0..n_full-1 for every order
+    full_orders = np.repeat(np.arange(len(order_quantities)), n_full)
+    offsets = np.repeat(np.cumsum(n_full) - n_full, n_full)
+    full_trades = np.arange(len(full_orders)) - offsets
+
+    # At most one excess fill per order: the trade that overshoots it
+    excess_orders = np.flatnonzero(n_seen > n_full)
+    excess_trades = n_full[excess_orders]
+    remaining = order_quantities[excess_orders] - before[excess_trades]
+
+    return full_orders, full_trades, excess_orders, excess_trades, remaining
+
+
+def _build_fills(client_orders, broker_trades, order_pos, trade_pos, quantity, status):
+    """Assemble match records for the given order/trade positions."""
+    brokerage = broker_trades['Brokerage Amount'].to_numpy()[trade_pos]
+    stt = broker_trades['STT'].to_numpy()[trade_pos]
+    net_amount = broker_trades['Net Amount'].to_numpy()[trade_pos]
+    trade_quantity = broker_trades['Quantity'].to_numpy()[trade_pos]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        net_price = np.where(trade_quantity > 0, net_amount / np.where(trade_quantity > 0, trade_quantity, 1), 0)
+
+    return pd.DataFrame({
+        'order_id': client_orders['UCC'].to_numpy()[order_pos],
+        'trade_id': broker_trades['UCC'].to_numpy()[trade_pos],
+        'symbol': broker_trades['Ticker'].to_numpy()[trade_pos],
+        'matched_quantity': quantity,
+        'status': status,
+        'brokerage_cost': brokerage,
+        'stt': stt,
+        'total_cost': brokerage + stt,
+        'execution_slippage': net_price,
+        'order_row': order_pos,
+        'trade_row': trade_pos,
+    }, columns=MATCH_COLUMNS)
+
+
+def hash_join_match(client_orders, broker_trades):
+    """
+    Match client orders to broker trades by grouping both sides once on
+    (Ticker, Direction, Date) instead of masking the full trade frame per order.
+    Returns (matched, unmatched, excess) DataFrames with the same rows, in the
+    same order, as the row-by-row TradeReconciliation loop.
+    """
+    orders = client_orders.reset_index(drop=True)
+    trades = broker_trades.reset_index(drop=True)
+
+    order_quantity = orders['Quantity'].to_numpy()
+    trade_quantity = trades['Quantity'].to_numpy()
+
+    trade_groups = trades.groupby(MATCH_KEYS, sort=False, observed=True).indices
+    order_groups = orders.groupby(MATCH_KEYS, sort=False, observed=True).indices
+
+    full_parts = ([], [])
+    excess_parts = ([], [], [])
+    has_trades = np.zeros(len(orders), dtype=bool)
+
+    for key, order_idx in order_groups.items():
+        trade_idx = trade_groups.get(key)
+        if trade_idx is None:
+            continue
+        has_trades[order_idx] = True
+
+        group_orders = order_quantity[order_idx]
+        group_trades = trade_quantity[trade_idx]
+
+        if np.all(group_trades >= 0) and not pd.isna(group_orders).any():
+            full_o, full_t, excess_o, excess_t, remaining = _allocate_group(group_orders, group_trades)
+        else:
+            full_o, full_t, excess_o, excess_t, remaining = [], [], [], [], []
+            for i, quantity in enumerate(group_orders):
+                full_fills, excess_fills = _allocate_loop(quantity, group_trades)
+                full_o.extend([i] * len(full_fills))
+                full_t.extend(full_fills)
+                for position, needed in excess_fills:
+                    excess_o.append(i)
+                    excess_t.append(position)
+                    remaining.append(needed)
+
+        full_parts[0].append(order_idx[np.asarray(full_o, dtype=int)])
+        full_parts[1].append(trade_idx[np.asarray(full_t, dtype=int)])
+        excess_parts[0].append(order_idx[np.asarray(excess_o, dtype=int)])
+        excess_parts[1].append(trade_idx[np.asarray(excess_t, dtype=int)])
+        excess_parts[2].append(np.asarray(remaining))
+
+    def _ordered(parts):
+        # Restore the loop's output order: client order first, then broker row
+        if not parts[0]:
+            return [np.array([], dtype=int) for _ in parts]
+        arrays = [np.concatenate(p) for p in parts]
+        order = np.lexsort((arrays[1], arrays[0]))
+        return [a[order] for a in arrays]
+
+    full_order_pos, full_trade_pos = _ordered(full_parts)
+    excess_order_pos, excess_trade_pos, excess_remaining = _ordered(excess_parts)
+
+    matched_quantity = trade_quantity[full_trade_pos]
+    matched = _build_fills(
+        orders, trades, full_order_pos, full_trade_pos, matched_quantity,
+        np.where(matched_quantity == order_quantity[full_order_pos], 'MATCHED', 'PARTIAL').astype(object)
+    )
+    excess = _build_fills(
+        orders, trades, excess_order_pos, excess_trade_pos, excess_remaining,
+        np.full(len(excess_order_pos), 'EXCESS', dtype=object)
+    )
+
+    pending = orders[~has_trades]
+    unmatched = pd.DataFrame({
+        'order_id': pending['UCC'].to_numpy(),
+        'symbol': pending['Ticker'].to_numpy(),
+        'quantity': pending['Quantity'].to_numpy(),
+        'status': 'PENDING',
+        'order_row': np.flatnonzero(~has_trades),
+    }, columns=PENDING_COLUMNS)
+
+    return matched, unmatched, excess
+
+
+def _first_column(df, *names):
+    """Return the first of names present in df (broker files and the matching layout name columns differently)."""
+    for name in names:
+        if name in df.columns:
+            return df[name]
+    raise KeyError(f"None of the columns {names} found")
+
+
+def load_isin_map(path):
+    """Load an ISIN-to-ticker mapping from a CSV with ISIN and Ticker columns."""
+    mapping = pd.read_csv(path, dtype=str)
+    return dict(zip(mapping['ISIN'].str.strip(), mapping['Ticker'].str.strip()))
+
+
+def _trade_tickers(trades, isin_map):
+    """Tickers of broker trades, translating ISINs through isin_map when given."""
+    if isin_map and 'Instrument ISIN' in trades.columns:
+        isins = trades['Instrument ISIN'].astype(object).to_numpy()
+        fallback = trades['Ticker'].astype(object).to_numpy() if 'Ticker' in trades.columns else isins
+        return np.array([isin_map.get(isin, default) for isin, default in zip(isins, fallback)], dtype=object)
+    return _first_column(trades, 'Ticker', 'Instrument ISIN').astype(object).to_numpy()
+
+
+# Key of a slot without an open order in _PriceIndex
+_CLOSED = (float('inf'), -1)
+
+
+class _PriceIndex:
+    """
+    Open orders of one (Ticker, Direction) group laid out by price (orders
+    without a price last), in a segment tree holding the smallest (window end,
+    order) of every range of the layout. The orders a trade's price accepts
+    form one range of the layout, so the open order whose window closes first
+    among them is found in O(log n) without visiting the others.
+    """
+
+    def __init__(self, order_idx, order_price):
+        prices = order_price[order_idx]
+        layout = np.argsort(prices, kind='stable')  # NaN sorts last
+        self.prices = prices[layout]
+        self.n_orders = len(layout)
+        self.n_priced = int(np.count_nonzero(~np.isnan(self.prices)))
+        self.slots = {o: slot for slot, o in enumerate(order_idx[layout].tolist())}
+        self.size = 1
+        while self.size < self.n_orders:
+            self.size *= 2
+        self.keys = [_CLOSED] * (2 * self.size)
+
+    def _set(self, order, key):
+        keys = self.keys
+        i = self.slots[order] + self.size
+        keys[i] = key
+        i //= 2
+        while i:
+            keys[i] = min(keys[2 * i], keys[2 * i + 1])
+            i //= 2
+
+    def open(self, order, end):
+        self._set(order, (end, order))
+
+    def close(self, order):
+        self._set(order, _CLOSED)
+
+    def first_closing(self, lo, hi):
+        """Smallest (window end, order) among the open orders in slots [lo, hi)."""
+        keys = self.keys
+        best = _CLOSED
+        lo += self.size
+        hi += self.size
+        while lo < hi:
+            if lo & 1:
+                best = min(best, keys[lo])
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                best = min(best, keys[hi])
+            lo //= 2
+            hi //= 2
+        return best
+
+    def band(self, price, tolerance):
+        """
+        Slot ranges of the orders whose price is within tolerance of price, plus
+        the orders without a price, which accept any trade. Prices must not be
+        negative, so the accepted prices are one interval of the layout.
+        """
+        if np.isnan(price):
+            return [(0, self.n_orders)]
+        prices = self.prices[:self.n_priced]
+
+        def fits(slot):
+            return not abs(price - prices[slot]) > tolerance * abs(prices[slot])
+
+        lo = int(np.searchsorted(prices, price / (1 + tolerance), side='left'))
+        hi = int(np.searchsorted(prices, price / (1 - tolerance), side='right')) if tolerance < 1 else self.n_priced
+        # The bounds are rounded; settle them on the exact check
+        while lo > 0 and fits(lo - 1):
+            lo -= 1
+        while lo < hi and not fits(lo):
+            lo += 1
+        while hi < self.n_priced and fits(hi):
+            hi += 1
+        while hi > lo and not fits(hi - 1):
+            hi -= 1
+        return [(lo, hi), (self.n_priced, self.n_orders)]
+
+
+def tolerance_match(client_orders, broker_trades, date_tolerance=0, quantity_tolerance=0.0,
+                    price_tolerance=None, isin_map=None):
+    """
+    Allocate broker trades to client orders with tolerances.
+
+    A trade can fill an order with the same Ticker (after mapping ISINs via
+    isin_map) and Direction when its date is within date_tolerance days of the
+    order date and, if price_tolerance is set and the order has a Price, its
+    price (Price or COST) is within that fraction of the order price. Orders may
+    be filled up to quantity_tolerance above their quantity and count as
+    MATCHED when filled to within quantity_tolerance below it.
+
+    Unlike the row loop, each trade's quantity is allocated only once. Within a
+    (Ticker, Direction) group orders are date intervals and trades are points,
+    so sweeping trades in date order and always filling the open order whose
+    window closes first maximizes the allocated quantity (Glover's rule for
+    convex bipartite matching). Open orders are kept in a heap by window end,
+    or with price_tolerance set in a _PriceIndex, so each trade reaches the
+    order it fills in O(log n) and the sweep runs in O(n log n). Order prices
+    must not be negative when price_tolerance is set.
+
+    Returns (matched, unmatched, excess): allocations, orders with no fill, and
+    trade quantity left over after allocation.
+    """
+    orders = client_orders.reset_index(drop=True)
+    trades = broker_trades.reset_index(drop=True)
+
+    tolerance = date_tolerance if isinstance(date_tolerance, pd.Timedelta) else pd.Timedelta(days=date_tolerance)
+    order_dates = pd.to_datetime(orders['Date']).to_numpy(dtype='datetime64[ns]')
+    order_start = order_dates - tolerance.to_timedelta64()
+    order_end = order_dates + tolerance.to_timedelta64()
+    trade_dates = pd.to_datetime(_first_column(trades, 'Date', 'Deal Date')).to_numpy(dtype='datetime64[ns]')
+
+    order_quantity = orders['Quantity'].to_numpy(dtype=float)
+    capacity = np.floor(order_quantity * (1 + quantity_tolerance) + 1e-9)
+    trade_quantity = _first_column(trades, 'Quantity', 'QTY').to_numpy(dtype=float)
+
+    check_price = price_tolerance is not None and 'Price' in orders.columns
+    if check_price:
+        order_price = orders['Price'].to_numpy(dtype=float)
+        trade_price = _first_column(trades, 'Price', 'COST').to_numpy(dtype=float)
+        if (order_price < 0).any():
+            raise ValueError("Order prices must not be negative when matching with a price tolerance")
+        # Window ends as integers, comparable with the _CLOSED key
+        order_end_ns = order_end.view(np.int64).tolist()
+        trade_dates_ns = trade_dates.view(np.int64)
+
+    order_groups = pd.DataFrame({
+        'Ticker': orders['Ticker'].astype(object).to_numpy(),
+        'Direction': orders['Direction'].astype(object).to_numpy(),
+    }).groupby(['Ticker', 'Direction'], sort=False).indices
+    trade_tickers = _trade_tickers(trades, isin_map)
+    trade_groups = pd.DataFrame({
+        'Ticker': trade_tickers,
+        'Direction': _first_column(trades, 'Direction', 'Buy/Sell Flag').astype(object).to_numpy(),
+    }).groupby(['Ticker', 'Direction'], sort=False).indices
+
+    alloc_order, alloc_trade, alloc_quantity = [], [], []
+    excess_trade, excess_quantity = [], []
+    grouped_trades = np.zeros(len(trades), dtype=bool)
+
+    for key, trade_idx in trade_groups.items():
+        grouped_trades[trade_idx] = True
+        order_idx = order_groups.get(key, np.array([], dtype=int))
+        # Sorted indexes: orders by window start, trades by date (stable keeps broker row order)
+        order_idx = order_idx[np.argsort(order_start[order_idx], kind='stable')]
+        trade_idx = trade_idx[np.argsort(trade_dates[trade_idx], kind='stable')]
+
+        open_orders = []  # heap of (window end, order position)
+        if check_price:
+            price_index = _PriceIndex(order_idx, order_price)
+        next_order = 0
+        for t in trade_idx:
+            trade_date = trade_dates[t]
+            while next_order < len(order_idx) and order_start[order_idx[next_order]] <= trade_date:
+                o = order_idx[next_order]
+                if not check_price:
+                    heapq.heappush(open_orders, (order_end[o], o))
+                elif not capacity[o] <= 0:
+                    price_index.open(o, order_end_ns[o])
+                next_order += 1
+
+            left = trade_quantity[t]
+            if check_price:
+                bands = price_index.band(trade_price[t], price_tolerance)
+            while left > 0:
+                if check_price:
+                    end, o = min(price_index.first_closing(lo, hi) for lo, hi in bands)
+                    if o < 0:
+                        break
+                    if end < trade_dates_ns[t]:
+                        price_index.close(o)  # window closed
+                        continue
+                else:
+                    if not open_orders:
+                        break
+                    end, o = open_orders[0]
+                    if end < trade_date or capacity[o] <= 0:
+                        heapq.heappop(open_orders)  # window closed or order filled
+                        continue
+                take = min(left, capacity[o])
+                alloc_order.append(o)
+                alloc_trade.append(t)
+                alloc_quantity.append(take)
+                capacity[o] -= take
+                left -= take
+                if capacity[o] <= 0:
+                    if check_price:
+                        price_index.close(o)
+                    else:
+                        heapq.heappop(open_orders)
+
+            if left > 0:
+                excess_trade.append(t)
+                excess_quantity.append(left)
+
+    # Trades whose key is missing cannot be allocated at all
+    for t in np.flatnonzero(~grouped_trades):
+        if trade_quantity[t] > 0:
+            excess_trade.append(t)
+            excess_quantity.append(trade_quantity[t])
+
+    alloc_order = np.asarray(alloc_order, dtype=int)
+    alloc_trade = np.asarray(alloc_trade, dtype=int)
+    alloc_quantity = np.asarray(alloc_quantity, dtype=float)
+    order = np.lexsort((alloc_trade, alloc_order))
+    alloc_order, alloc_trade, alloc_quantity = alloc_order[order], alloc_trade[order], alloc_quantity[order]
+
+    filled = np.bincount(alloc_order, weights=alloc_quantity, minlength=len(orders))
+    fully_filled = filled >= order_quantity * (1 - quantity_tolerance) - 1e-9
+    order_status = np.where(fully_filled, 'MATCHED', 'PARTIAL').astype(object)
+
+    matched = _build_allocations(trades, trade_tickers, alloc_trade, alloc_quantity, trade_quantity,
+                                 orders['UCC'].to_numpy()[alloc_order], order_status[alloc_order], alloc_order)
+
+    excess_trade = np.asarray(excess_trade, dtype=int)
+    excess = _build_allocations(trades, trade_tickers, excess_trade, np.asarray(excess_quantity, dtype=float), trade_quantity,
+                                np.full(len(excess_trade), None, dtype=object),
+                                np.full(len(excess_trade), 'EXCESS', dtype=object),
+                                np.full(len(excess_trade), None, dtype=object))
+
+    pending = orders[filled <= 0]
+    unmatched = pd.DataFrame({
+        'order_id': pending['UCC'].to_numpy(),
+        'symbol': pending['Ticker'].to_numpy(),
+        'quantity': pending['Quantity'].to_numpy(),
+        'status': 'PENDING',
+        'order_row': np.flatnonzero(filled <= 0),
+    }, columns=PENDING_COLUMNS)
+
+    return matched, unmatched, excess
+
+
+def _build_allocations(trades, trade_tickers, trade_pos, quantity, trade_quantity, order_ids, status, order_pos):
+    """Assemble allocation records, pro-rating trade costs by the allocated share."""
+    share = np.divide(quantity, trade_quantity[trade_pos], out=np.zeros(len(trade_pos)),
+                      where=trade_quantity[trade_pos] > 0)
+    brokerage = _first_column(trades, 'Brokerage Amount').to_numpy(dtype=float)[trade_pos] * share
+    stt = _first_column(trades, 'STT').to_numpy(dtype=float)[trade_pos] * share
+    net_amount = _first_column(trades, 'Net Amount', 'NET AMOUNT').to_numpy(dtype=float)[trade_pos] * share
+    trade_ids = trades['UCC'].to_numpy()[trade_pos] if 'UCC' in trades.columns else trade_pos
+
+    # The pro-rated net amount over the allocated quantity is the trade's net price
+    with np.errstate(divide='ignore', invalid='ignore'):
+        net_price = np.where(quantity > 0, net_amount / np.where(quantity > 0, quantity, 1), 0)
+
+    return pd.DataFrame({
+        'order_id': order_ids,
+        'trade_id': trade_ids,
+        'symbol': trade_tickers[trade_pos],
+        'matched_quantity': quantity,
+        'status': status,
+        'brokerage_cost': brokerage,
+        'stt': stt,
+        'total_cost': brokerage + stt,
+        'execution_slippage': net_price,
+        'order_row': order_pos,
+        'trade_row': trade_pos,
+    }, columns=MATCH_COLUMNS)
@@ -1,43 +1,370 @@
+import hashlib
+import json
+import logging
+import numpy as np
 import pandas as pd
 import sqlite3
+import sys
+import uuid
 from datetime import datetime
-from extract_trades import load_client_orders, extract_broker_files
+from extract_trades import ingest_emails
+from matching_engine import MATCH_COLUMNS, MATCH_KEYS, hash_join_match, tolerance_match
+from trade_schema import concat_trades, to_matching_layout
+from instrumentation import configure_logging, count, timed
+
+logger = logging.getLogger(__name__)
+
+# 'loop' matches order by order, 'vectorized' uses the grouped hash-join engine
+MATCHING_MODES = ('loop', 'vectorized')
+# 'incremental' applies only new broker trades on top of state persisted in SQLite,
+# 'tolerance' allocates each trade once with date/quantity/price tolerances
+RECONCILIATION_MODES = MATCHING_MODES + ('incremental', 'tolerance')
+
+# Broker trade columns kept in the incremental state so new orders can be replayed
+INCREMENTAL_TRADE_COLUMNS = ['UCC', 'Ticker', 'Direction', 'Date', 'Quantity', 'Brokerage Amount', 'STT', 'Net Amount']
+
+def _sql_value(value):
+    """Convert NumPy scalars to plain Python values sqlite3 can bind."""
+    return value.item() if isinstance(value, np.generic) else value
+
+# Broker trade column identifying the broker, part of a batch run's id
+BROKER_COLUMN = 'party code/SEBI regn code of party'
+
+# Column layout of the persisted tables; run_id identifies the run that wrote a row
+TABLE_COLUMNS = {
+    'client_orders': ['UCC', 'Ticker', 'Quantity', 'Direction', 'Date'],
+    'broker_trades': ['UCC', 'Ticker', 'Quantity', 'Direction', 'Date', 'Brokerage_Amount', 'STT', 'Net_Amount'],
+    'reconciliation_results': ['order_id', 'trade_id', 'symbol', 'matched_quantity', 'status',
+                               'brokerage_cost', 'stt', 'total_cost', 'execution_slippage'],
+}
+
+# Open connections reused across saves, keyed by database path
+_CONNECTIONS = {}
+
+def get_connection(db_name='trades.db'):
+    """Return a shared connection to db_name, opened in WAL mode on first use."""
+    conn = _CONNECTIONS.get(db_name)
+    if conn is None:
+        conn = sqlite3.connect(db_name)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA cache_size=-65536')  # 64 MB page cache
+        _CONNECTIONS[db_name] = conn
+    return conn
+
+def close_connections():
+    """Close every shared database connection."""
+    while _CONNECTIONS:
+        _, conn = _CONNECTIONS.popitem()
+        conn.close()
+
+def _create_tables(conn):
+    """Create the result tables and their indexes if they do not exist."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS client_orders (
+            UCC TEXT,
+            Ticker TEXT,
+            Quantity INTEGER,
+            Direction TEXT,
+            Date TEXT,
+            run_id TEXT
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS broker_trades (
+            UCC TEXT,
+            Ticker TEXT,
+            Quantity INTEGER,
+            Direction TEXT,
+            Date TEXT,
+            Brokerage_Amount REAL,
+            STT REAL,
+            Net_Amount REAL,
+            run_id TEXT
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS reconciliation_results (
+            order_id TEXT,
+            trade_id TEXT,
+            symbol TEXT,
+            matched_quantity INTEGER,
+            status TEXT,
+            brokerage_cost REAL,
+            stt REAL,
+            total_cost REAL,
+            execution_slippage REAL,
+            run_id TEXT
+        )
+    ''')
+
+    # Databases created before run ids existed get the column added
+    for table in TABLE_COLUMNS:
+        existing = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+        if 'run_id' not in existing:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN run_id TEXT')
+
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_client_orders_key ON client_orders (Ticker, Direction, Date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_broker_trades_key ON broker_trades (Ticker, Direction, Date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_results_order_id ON reconciliation_results (order_id)')
+    for table in TABLE_COLUMNS:
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_run_id ON {table} (run_id)')
+    conn.commit()
+
+def _replace_run_rows(conn, table, df, run_id):
+    """Replace the rows of run_id in table with the contents of df via executemany."""
+    conn.execute(f'DELETE FROM {table} WHERE run_id = ?', (run_id,))
+    if df is None or df.empty:
+        return
+
+    # DataFrame columns use spaces where the table uses underscores
+    df = df.rename(columns=lambda c: c.replace(' ', '_'))
+    columns = [c for c in TABLE_COLUMNS[table] if c in df.columns]
+    if not columns:
+        return
+
+    values = df[columns].copy()
+    for column in columns:
+        if pd.api.types.is_datetime64_any_dtype(values[column]):
+            values[column] = values[column].astype(str)
+    values = values.astype(object).where(values.notna(), None)
+    values['run_id'] = run_id
+
+    placeholders = ', '.join('?' for _ in range(len(columns) + 1))
+    conn.executemany(
+        f'INSERT INTO {table} ({", ".join(columns)}, run_id) VALUES ({placeholders})',
+        values.itertuples(index=False, name=None)
+    )
 
 class TradeReconciliation:
-    def __init__(self, client_orders, broker_trades):
+    def __init__(self, client_orders, broker_trades, mode='loop', state_db='trades.db', tolerances=None):
+        if mode not in RECONCILIATION_MODES:
+            raise ValueError(f"Unknown matching mode: {mode}. Expected one of {RECONCILIATION_MODES}")
         self.client_orders = client_orders
         self.broker_trades = broker_trades
+        self.mode = mode
+        self.state_db = state_db
+        # Keyword arguments for tolerance_match, e.g. {'date_tolerance': 1, 'isin_map': {...}}
+        self.tolerances = tolerances or {}
         self.matched_trades = []
         self.unmatched_trades = []
         self.excess_trades = []
+        # Id the results of this instance are saved under, assigned on first save
+        self.run_id = None
+        # Open-order index for match_fill, built on first use
+        self._order_index = None
+        self._remaining = None
+        # Fills recorded by match_fill, kept apart from the results of reconcile()
+        self.online_matched = []
+        self.online_excess = []
 
+    @timed('matching')
     def reconcile(self):
         """Main reconciliation function."""
-        for _, order in self.client_orders.iterrows():
-            matches = self._find_matching_trades(order)
+        count('orders_reconciled', len(self.client_orders))
+        count('trades_reconciled', len(self.broker_trades))
+        if self.mode == 'vectorized':
+            self._reconcile_vectorized()
+            return
+        if self.mode == 'incremental':
+            self._reconcile_incremental()
+            return
+        if self.mode == 'tolerance':
+            self.matched_trades, self.unmatched_trades, self.excess_trades = tolerance_match(
+                self.client_orders, self.broker_trades, **self.tolerances)
+            return
+
+        for order_row, (_, order) in enumerate(self.client_orders.iterrows()):
+            trade_rows = self._find_matching_trades(order)
             
-            if matches.empty:
+            if len(trade_rows) == 0:
                 # No matches found - mark as pending
-                self._mark_as_pending(order)
+                self._mark_as_pending(order, order_row)
             else:
                 # Process matches based on quantity
-                self._process_matches(order, matches)
+                self._process_matches(order, self.broker_trades.iloc[trade_rows],
+                                      order_row=order_row, trade_rows=trade_rows)
+
+    def _reconcile_vectorized(self):
+        """
+        Reconcile all orders in one pass with the hash-join engine.
+        Results are kept as DataFrames rather than lists of dicts.
+        """
+        matched, unmatched, excess = hash_join_match(self.client_orders, self.broker_trades)
+        self.matched_trades = matched
+        self.unmatched_trades = unmatched
+        self.excess_trades = excess
+
+    def _reconcile_incremental(self):
+        """
+        Apply only the broker trades given to this instance on top of the state
+        persisted by earlier runs in state_db. Trades applied before are skipped,
+        so a batch delivered twice is only applied once. Only orders whose
+        (Ticker, Direction, Date) received new trades, or that were never seen
+        before, are processed; results contain the fills produced by this run.
+        """
+        conn = get_connection(self.state_db)
+        try:
+            self._create_incremental_tables(conn)
+
+            new_rows, fingerprints = self._unapplied_trades(conn)
+            trades = self.broker_trades.iloc[new_rows]
+
+            state = {
+                tuple(row[:4]): (row[4], row[5])
+                for row in conn.execute(
+                    'SELECT order_id, Ticker, Direction, Date, matched_quantity, status FROM order_state'
+                )
+            }
+
+            trade_positions = trades.groupby(MATCH_KEYS, sort=False, observed=True).indices
+            order_keys = pd.MultiIndex.from_frame(self.client_orders[MATCH_KEYS])
+            state_keys = self._state_keys(self.client_orders)
+
+            # Untouched known orders are skipped entirely
+            touched = order_keys.isin(list(trade_positions)) | ~state_keys.isin(list(state))
+
+            state_updates = []
+            for order_row, (_, order), state_key in zip(np.flatnonzero(touched), self.client_orders[touched].iterrows(),
+                                                        state_keys[touched]):
+                excess_before = len(self.excess_trades)
+
+                if state_key in state:
+                    total_matched, status = state[state_key]
+                    has_trades = True
+                else:
+                    # First time this order is seen: replay trades applied in earlier runs
+                    history = pd.read_sql_query(
+                        'SELECT * FROM applied_trades WHERE Ticker = ? AND Direction = ? AND Date = ? ORDER BY rowid',
+                        conn, params=list(state_key[1:])
+                    )
+                    # Trades of earlier runs are not in broker_trades, so their fills have no trade_row
+                    total_matched = self._process_matches(order, history, order_row=order_row) if not history.empty else 0
+                    status = None
+                    has_trades = not history.empty
+
+                positions = trade_positions.get((order['Ticker'], order['Direction'], order['Date']))
+                if positions is not None:
+                    total_matched = self._process_matches(order, trades.iloc[positions], total_matched,
+                                                          order_row=order_row, trade_rows=new_rows[positions])
+                    has_trades = True
+
+                if not has_trades:
+                    self._mark_as_pending(order, order_row)
+                    status = 'PENDING'
+                elif status == 'EXCESS' or len(self.excess_trades) > excess_before:
+                    status = 'EXCESS'
+                elif total_matched >= order['Quantity']:
+                    status = 'MATCHED'
+                elif total_matched > 0:
+                    status = 'PARTIAL'
+                else:
+                    status = 'PENDING'
+
+                state_updates.append(state_key + (_sql_value(order['Quantity']), _sql_value(total_matched), status))
+
+            conn.executemany(
+                'INSERT OR REPLACE INTO order_state '
+                '(order_id, Ticker, Direction, Date, quantity, matched_quantity, status) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                state_updates
+            )
+
+            if not trades.empty:
+                applied = trades[INCREMENTAL_TRADE_COLUMNS].copy()
+                applied[['UCC'] + MATCH_KEYS] = applied[['UCC'] + MATCH_KEYS].astype(str)
+                applied['fingerprint'] = fingerprints
+                applied.to_sql('applied_trades', conn, if_exists='append', index=False)
+
+            conn.commit()
+            logger.info("Incremental run: %d new trades, %d already applied, %d orders updated.",
+                        len(trades), len(self.broker_trades) - len(trades), len(state_updates))
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _unapplied_trades(self, conn):
+        """
+        Positions and fingerprints of the broker trades not applied by an
+        earlier run. Identical fills are told apart by their occurrence, so a
+        fill that repeats within a batch is applied as often as it appears
+        there, while a batch delivered again adds nothing.
+        """
+        from trade_dedup import fingerprint_keys, row_fingerprints
+        from trade_schema import BROKER_FILE_COLUMNS
+
+        columns = [c for c in BROKER_FILE_COLUMNS if c in self.broker_trades.columns] or INCREMENTAL_TRADE_COLUMNS
+        hashes = row_fingerprints(self.broker_trades, columns)
+        stored = np.array([row[0] for row in conn.execute(
+            'SELECT fingerprint FROM applied_trades WHERE fingerprint IS NOT NULL')], dtype=np.int64)
+        new_rows = np.flatnonzero(~fingerprint_keys(hashes).isin(fingerprint_keys(stored)))
+        return new_rows, hashes[new_rows]
+
+    @staticmethod
+    def _state_keys(df):
+        """Identify orders or trades in the persisted state by their text (UCC, Ticker, Direction, Date)."""
+        return pd.MultiIndex.from_frame(df[['UCC'] + MATCH_KEYS].astype(str))
+
+    @staticmethod
+    def _create_incremental_tables(conn):
+        """Create the tables holding incremental reconciliation state."""
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS order_state (
+                order_id TEXT,
+                Ticker TEXT,
+                Direction TEXT,
+                Date TEXT,
+                quantity INTEGER,
+                matched_quantity INTEGER,
+                status TEXT,
+                PRIMARY KEY (order_id, Ticker, Direction, Date)
+            )
+        ''')
+
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS applied_trades (
+                UCC TEXT,
+                Ticker TEXT,
+                Direction TEXT,
+                Date TEXT,
+                Quantity INTEGER,
+                "Brokerage Amount" REAL,
+                STT REAL,
+                "Net Amount" REAL,
+                fingerprint INTEGER
+            )
+        ''')
+        # State written before trades were fingerprinted cannot be checked for repeats
+        existing = {row[1] for row in conn.execute('PRAGMA table_info(applied_trades)')}
+        if 'fingerprint' not in existing:
+            conn.execute('ALTER TABLE applied_trades ADD COLUMN fingerprint INTEGER')
+
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_applied_trades_key ON applied_trades (Ticker, Direction, Date)')
 
     def _find_matching_trades(self, order):
-        """Find potential matching trades based on basic criteria."""
-        matches = self.broker_trades[
+        """Find the positions of potential matching trades based on basic criteria."""
+        matches = (
             (self.broker_trades['Ticker'] == order['Ticker']) &
             (self.broker_trades['Direction'] == order['Direction']) &
             (self.broker_trades['Date'] == order['Date'])  # Assuming Date is a column
-        ]
-        return matches
+        )
+        return np.flatnonzero(matches.to_numpy())
 
-    def _process_matches(self, order, matching_trades):
-        """Process matching trades based on quantity logic."""
+    def _process_matches(self, order, matching_trades, total_matched=0, order_row=None, trade_rows=None):
+        """
+        Process matching trades based on quantity logic.
+        total_matched is the quantity already filled by earlier trades;
+        returns the filled quantity after these trades. order_row and
+        trade_rows are the positions recorded with the fills.
+        """
         order_quantity = order['Quantity']
-        total_matched = 0
+        if trade_rows is None:
+            trade_rows = [None] * len(matching_trades)
 
-        for _, trade in matching_trades.iterrows():
+        for trade_row, (_, trade) in zip(trade_rows, matching_trades.iterrows()):
             if total_matched >= order_quantity:
                 break
 
@@ -54,7 +381,9 @@ class TradeReconciliation:
                     'brokerage_cost': trade['Brokerage Amount'],
                     'stt': trade['STT'],
                     'total_cost': trade['Brokerage Amount'] + trade['STT'],
-                    'execution_slippage': trade['Net Amount'] / trade_quantity if trade_quantity > 0 else 0
+                    'execution_slippage': trade['Net Amount'] / trade_quantity if trade_quantity > 0 else 0,
+                    'order_row': order_row,
+                    'trade_row': trade_row,
                 })
                 total_matched += trade_quantity
             else:
@@ -69,19 +398,130 @@ class TradeReconciliation:
                     'brokerage_cost': trade['Brokerage Amount'],
                     'stt': trade['STT'],
                     'total_cost': trade['Brokerage Amount'] + trade['STT'],
-                    'execution_slippage': trade['Net Amount'] / remaining_needed if remaining_needed > 0 else 0
+                    'execution_slippage': trade['Net Amount'] / trade_quantity if trade_quantity > 0 else 0,
+                    'order_row': order_row,
+                    'trade_row': trade_row,
                 })
                 total_matched += remaining_needed
 
-    def _mark_as_pending(self, order):
+        return total_matched
+
+    def _mark_as_pending(self, order, order_row=None):
         """Mark unmatched orders as pending."""
         self.unmatched_trades.append({
             'order_id': order['UCC'],
             'symbol': order['Ticker'],
             'quantity': order['Quantity'],
-            'status': 'PENDING'
+            'status': 'PENDING',
+            'order_row': order_row,
         })
 
+    def build_order_index(self):
+        """
+        Precompute the open-order index used by match_fill: order positions per
+        (Ticker, Direction, Date) with a cursor at the first order still open,
+        and the remaining quantity of every order in one array. Order dates are
+        keyed as Timestamps, like the dates of the fills.
+        """
+        orders = self.client_orders.reset_index(drop=True)
+        try:
+            keys = orders[MATCH_KEYS].assign(Date=pd.to_datetime(orders['Date']))
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Order dates must be dates to match fills online: {e}") from e
+        self._order_ids = orders['UCC'].to_numpy()
+        self._order_quantity = orders['Quantity'].to_numpy()
+        self._remaining = self._order_quantity.copy()
+        self._order_index = {
+            key: [positions, 0]
+            for key, positions in keys.groupby(MATCH_KEYS, sort=False, observed=True).indices.items()
+        }
+
+    def match_fill(self, trade):
+        """
+        Match a single broker fill (a mapping or Series with the broker trade
+        columns) against the open orders in O(1): the fill goes to the first
+        open order with its (Ticker, Direction, Date), by the same MATCHED /
+        PARTIAL / EXCESS rules as the row loop. Quantity beyond that order
+        carries over to the next open order; what is left when none remain is
+        recorded as EXCESS without an order. The fill's Date is compared as a
+        Timestamp, so orders and fills may give dates as strings or datetimes.
+        Returns the records produced, which are also kept for online_results().
+        """
+        if self._order_index is None:
+            self.build_order_index()
+
+        quantity = trade['Quantity']
+        group = self._order_index.get((trade['Ticker'], trade['Direction'], pd.Timestamp(trade['Date'])))
+        records = []
+
+        while group is not None and quantity > 0:
+            positions, cursor = group
+            if cursor == len(positions):
+                break
+            order = positions[cursor]
+            remaining = self._remaining[order]
+
+            if quantity <= remaining:
+                record = self._fill_record(trade, self._order_ids[order], quantity,
+                                           'MATCHED' if quantity == self._order_quantity[order] else 'PARTIAL', order)
+                self.online_matched.append(record)
+                self._remaining[order] = remaining - quantity
+                quantity = 0
+            else:
+                record = self._fill_record(trade, self._order_ids[order], remaining, 'EXCESS', order)
+                self.online_excess.append(record)
+                self._remaining[order] = 0
+                quantity -= remaining
+            records.append(record)
+
+            if self._remaining[order] <= 0:
+                group[1] = cursor + 1  # Order is complete, later fills go to the next one
+
+        if quantity > 0:
+            record = self._fill_record(trade, None, quantity, 'EXCESS')
+            self.online_excess.append(record)
+            records.append(record)
+
+        count('fills_matched')
+        return records
+
+    @staticmethod
+    def _fill_record(trade, order_id, quantity, status, order_row=None):
+        # The fill is not a row of broker_trades, so it has no trade_row
+        return {
+            'order_id': order_id,
+            'trade_id': trade['UCC'],
+            'symbol': trade['Ticker'],
+            'matched_quantity': quantity,
+            'status': status,
+            'brokerage_cost': trade['Brokerage Amount'],
+            'stt': trade['STT'],
+            'total_cost': trade['Brokerage Amount'] + trade['STT'],
+            'execution_slippage': trade['Net Amount'] / trade['Quantity'] if trade['Quantity'] > 0 else 0,
+            'order_row': order_row,
+            'trade_row': None,
+        }
+
+    def open_orders(self):
+        """Orders still waiting for quantity from match_fill, with their remaining quantity."""
+        if self._order_index is None:
+            self.build_order_index()
+        is_open = self._remaining > 0
+        return pd.DataFrame({
+            'order_id': self._order_ids[is_open],
+            'symbol': self.client_orders['Ticker'].to_numpy()[is_open],
+            'quantity': self._order_quantity[is_open],
+            'remaining_quantity': self._remaining[is_open],
+            'status': np.where(self._remaining[is_open] == self._order_quantity[is_open], 'PENDING', 'PARTIAL'),
+        })
+
+    def online_results(self):
+        """Return the matched and excess fills recorded by match_fill."""
+        return {
+            'matched': pd.DataFrame(self.online_matched, columns=MATCH_COLUMNS),
+            'excess': pd.DataFrame(self.online_excess, columns=MATCH_COLUMNS),
+        }
+
     def get_results(self):
         """Return reconciliation results."""
         return {
@@ -90,83 +530,58 @@ class TradeReconciliation:
             'excess': pd.DataFrame(self.excess_trades)
         }
 
-    def save_to_database(self, db_name='trades.db'):
-        """Store data in SQLite database."""
-        conn = sqlite3.connect(db_name)
-        
-        # Create tables if they do not exist
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS client_orders (
-                UCC TEXT,
-                Ticker TEXT,
-                Quantity INTEGER,
-                Direction TEXT,
-                Date TEXT
-            )
-        ''')
-        
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS broker_trades (
-                UCC TEXT,
-                Ticker TEXT,
-                Quantity INTEGER,
-                Direction TEXT,
-                Date TEXT,
-                Brokerage_Amount REAL,
-                STT REAL,
-                Net_Amount REAL
-            )
-        ''')
-        
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS reconciliation_results (
-                order_id TEXT,
-                trade_id TEXT,
-                symbol TEXT,
-                matched_quantity INTEGER,
-                status TEXT,
-                brokerage_cost REAL,
-                stt REAL,
-                total_cost REAL,
-                execution_slippage REAL
-            )
-        ''')
-        
-        # Insert client orders into the database
-        if not self.client_orders.empty:
-            self.client_orders.to_sql('client_orders', conn, if_exists='append', index=False)
+    @timed('database_save')
+    def save_to_database(self, db_name='trades.db', run_id=None):
+        """
+        Store data in SQLite database and return the run id its rows are tagged with.
+        Saving a run again replaces its rows instead of duplicating them. Without
+        a run_id a batch reconciliation is identified by its mode and the deal
+        dates and brokers of its trades, so reconciling the same day again
+        replaces the earlier rows. Incremental runs only hold the delta of their
+        trades, so each gets its own id (a timestamp plus a random suffix).
+        """
+        if run_id is None:
+            run_id = self.run_id or self._default_run_id()
+        self.run_id = run_id
 
-        # Insert broker trades into the database
-        if not self.broker_trades.empty:
-            self.broker_trades.to_sql('broker_trades', conn, if_exists='append', index=False)
+        conn = get_connection(db_name)
+        _create_tables(conn)
 
-        # Insert matched trades into the reconciliation results table
-        matched_df = pd.DataFrame(self.matched_trades)
-        if not matched_df.empty:
-            matched_df.to_sql('reconciliation_results', conn, if_exists='append', index=False)
+        # One transaction for the whole save, rolled back on failure
+        with conn:
+            _replace_run_rows(conn, 'client_orders', self.client_orders, run_id)
+            _replace_run_rows(conn, 'broker_trades', self.broker_trades, run_id)
+            _replace_run_rows(conn, 'reconciliation_results', pd.DataFrame(self.matched_trades), run_id)
+        return run_id
 
-        conn.commit()
-        conn.close()
+    def _default_run_id(self):
+        if self.mode == 'incremental':
+            return f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        trades = self.broker_trades
+        dates = pd.to_datetime(trades['Date'] if 'Date' in trades.columns else trades['Deal Date'])
+        brokers = trades[BROKER_COLUMN].astype(str).unique() if BROKER_COLUMN in trades.columns else []
+        scope = {
+            'mode': self.mode,
+            'dates': sorted(dates.dropna().dt.strftime('%Y-%m-%d').unique()),
+            'brokers': sorted(brokers),
+        }
+        digest = hashlib.sha1(json.dumps(scope).encode()).hexdigest()[:16]
+        return f"{self.mode}-{digest}"
 
-def main():
-    # Load data
-    client_orders = load_client_orders()
+def main(data_dir='data'):
+    from run_reconciliation import find_email_paths
+    email_paths = find_email_paths(data_dir)
+
+    # Load client orders and broker trades in a single pass over the emails
+    client_orders, broker_trades = ingest_emails(email_paths)
     
     # Check if client orders were loaded successfully
     if client_orders is None:
-        print("No client orders found. Exiting reconciliation.")
+        logger.warning("No client orders found. Exiting reconciliation.")
         return  # Exit if no client orders are found
 
-    email_paths = [
-        r'C:\Users\Sankalp\Desktop\trade_reconciliation\data\Trade File BROKER 1 - 31_01_2025.eml',
-        r'C:\Users\Sankalp\Desktop\trade_reconciliation\data\Trade File BROKER 2 - 31_01_2025.eml',
-        r'C:\Users\Sankalp\Desktop\trade_reconciliation\data\Trade File BROKER 3 - 31_01_2025.eml'
-    ]
-    
-    broker_trades = extract_broker_files(email_paths)
-
     # Initialize reconciliation
-    reconciler = TradeReconciliation(client_orders, pd.concat(broker_trades))
+    reconciler = TradeReconciliation(client_orders, to_matching_layout(concat_trades(broker_trades)))
     
     # Run reconciliation
     reconciler.reconcile()
@@ -185,4 +600,5 @@ def main():
     print(results['excess'])
 
 if __name__ == "__main__":
-    main()
+    configure_logging()
+    main(sys.argv[1] if len(sys.argv) > 1 else 'data')
@@ -1,22 +1,35 @@
+import logging
 import pandas as pd
 from datetime import datetime
 from extract_trades import extract_broker_files
+from trade_schema import concat_trades
+from instrumentation import configure_logging, timed
+from report_writers import write_reports
+from cost_analytics import TRADE_PRICE_COLUMNS, BPS, add_trade_costs, broker_cost_distribution
 import os
+import sys
 
+logger = logging.getLogger(__name__)
+
+@timed('cost_calculation')
 def calculate_costs(broker_trades_df):
     """Calculate costs for each trade and return updated DataFrame."""
     try:
         # Calculate total cost as sum of Brokerage Amount and STT
         broker_trades_df['Total Cost'] = broker_trades_df['Brokerage Amount'] + broker_trades_df['STT']
+        # Per-trade value, net price and bps costs when the price columns are present
+        if all(c in broker_trades_df.columns for c in TRADE_PRICE_COLUMNS + ['Buy/Sell Flag']):
+            broker_trades_df = add_trade_costs(broker_trades_df)
         return broker_trades_df
     except Exception as e:
-        print(f"Error calculating costs: {str(e)}")
+        logger.error("Error calculating costs: %s", e)
         return broker_trades_df  # Return original DataFrame in case of error
 
+@timed('report.matched_trades')
 def generate_matched_trades_report(broker_trades_df, output_dir):
     """Generate detailed report of matched broker trades."""
     if broker_trades_df is None or broker_trades_df.empty:
-        print("No broker trades data available.")
+        logger.warning("No broker trades data available.")
         return False
     
     try:
@@ -26,22 +39,23 @@ def generate_matched_trades_report(broker_trades_df, output_dir):
         # Save to CSV
         output_path = os.path.join(output_dir, 'matched_trades.csv')
         broker_trades_df.to_csv(output_path, index=False)
-        print(f"Generated matched trades report: {output_path}")
+        logger.info("Generated matched trades report: %s", output_path)
         
         return True
     except Exception as e:
-        print(f"Error generating matched trades report: {str(e)}")
+        logger.error("Error generating matched trades report: %s", e)
         return False
 
+@timed('report.unmatched_trades')
 def generate_unmatched_trades_report(broker_trades_df, output_dir):
     """Generate report of unmatched broker trades."""
     if broker_trades_df is None or broker_trades_df.empty:
-        print("No broker trades data available.")
+        logger.warning("No broker trades data available.")
         return False
 
     try:
-        # Print columns to check if 'trade_id' exists
-        print("Columns in broker trades:", broker_trades_df.columns)
+        # Log columns to check if 'trade_id' exists
+        logger.debug("Columns in broker trades: %s", broker_trades_df.columns.tolist())
         
         # Assuming unmatched trades are those with a missing 'trade_id' or an empty 'match_status'
         # Option 1: Filter based on 'trade_id' being null
@@ -51,7 +65,7 @@ def generate_unmatched_trades_report(broker_trades_df, output_dir):
         # unmatched_trades_df = broker_trades_df[broker_trades_df['match_status'] == 'unmatched']
 
         if unmatched_trades_df.empty:
-            print("No unmatched trades found.")
+            logger.info("No unmatched trades found.")
             return False
         
         # Add timestamp to each record for report tracking
@@ -60,86 +74,217 @@ def generate_unmatched_trades_report(broker_trades_df, output_dir):
         # Save the unmatched trades to a CSV file
         output_path = os.path.join(output_dir, 'unmatched_trades.csv')
         unmatched_trades_df.to_csv(output_path, index=False)
-        print(f"Generated unmatched trades report: {output_path}")
+        logger.info("Generated unmatched trades report: %s", output_path)
 
         return True
     except Exception as e:
-        print(f"Error generating unmatched trades report: {str(e)}")
+        logger.error("Error generating unmatched trades report: %s", e)
         return False
 
 
-def generate_broker_summary(broker_trades_df, output_dir):
-    """Generate summary report by broker."""
+@timed('report.matched_trades')
+def append_matched_trades_chunk(broker_trades_df, output_path, generated_at, columns=None):
+    """
+    Append one chunk of broker trades to the matched trades CSV.
+    The header is written only when the file does not exist yet.
+    """
     try:
-        # Create broker summary
-        summary = []
-        
-        # Get unique brokers from broker trades DataFrame
-        brokers = broker_trades_df['party code/SEBI regn code of party'].unique()
-        
-        for broker in brokers:
-            broker_data = broker_trades_df[broker_trades_df['party code/SEBI regn code of party'] == broker]
-            total_quantity = broker_data['QTY'].sum()
-            total_brokerage_cost = broker_data['Brokerage Amount'].sum()
-            total_stt = broker_data['STT'].sum()
-            total_cost = broker_data['Total Cost'].sum()  # Use calculated total cost
-            
-            summary.append({
-                'broker_id': broker,
-                'total_trades': len(broker_data),
-                'total_quantity': total_quantity,
-                'total_brokerage_cost': total_brokerage_cost,
-                'total_stt': total_stt,
-                'total_cost': total_cost,
-            })
-        
-        # Create summary DataFrame
-        summary_df = pd.DataFrame(summary)
-        
-        # Add timestamp
-        summary_df['generated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        
-        # Save to CSV
+        if columns is not None:
+            # Keep every chunk aligned with the columns of the first one
+            broker_trades_df = broker_trades_df.reindex(columns=columns)
+        broker_trades_df = broker_trades_df.assign(generated_at=generated_at)
+
+        write_header = not os.path.exists(output_path)
+        broker_trades_df.to_csv(output_path, mode='a', header=write_header, index=False)
+        return True
+    except Exception as e:
+        logger.error("Error appending matched trades chunk: %s", e)
+        return False
+
+BROKER_COLUMN = 'party code/SEBI regn code of party'
+
+# Dimensions available for broker summary rollups
+SUMMARY_DIMENSIONS = {
+    'isin': 'Instrument ISIN',
+    'deal_date': 'Deal Date',
+    'exchange': 'Exchange Code',
+    'side': 'Buy/Sell Flag',
+}
+
+SUMMARY_TOTAL_COLUMNS = ['total_trades', 'total_quantity', 'total_brokerage_cost', 'total_stt', 'total_cost',
+                         'total_gross_value']
+
+def _add_cost_bps(summary_df):
+    """Add the value-weighted cost in bps, which unlike the totals cannot be summed across groups."""
+    gross_value = summary_df['total_gross_value'].abs().replace(0, float('nan'))
+    summary_df['cost_bps'] = summary_df['total_cost'] / gross_value * BPS
+    return summary_df
+
+def aggregate_broker_trades(broker_trades_df, rollups=()):
+    """
+    Aggregate broker trades in a single groupby pass.
+    Rows are grouped once by broker plus every dimension any rollup needs;
+    the broker summary and each rollup are then re-aggregated from those
+    (much smaller) groups. Returns a dict of DataFrames keyed 'broker' for the
+    broker summary and by rollup name (dimensions joined with '_') otherwise.
+    """
+    rollups = [(r,) if isinstance(r, str) else tuple(r) for r in rollups]
+    for rollup in rollups:
+        for dimension in rollup:
+            if dimension not in SUMMARY_DIMENSIONS:
+                raise ValueError(f"Unknown summary dimension: {dimension}. Expected one of {list(SUMMARY_DIMENSIONS)}")
+
+    dimension_columns = []
+    for rollup in rollups:
+        for dimension in rollup:
+            if SUMMARY_DIMENSIONS[dimension] not in dimension_columns:
+                dimension_columns.append(SUMMARY_DIMENSIONS[dimension])
+
+    if 'Gross Value' not in broker_trades_df.columns:
+        broker_trades_df = broker_trades_df.assign(**{'Gross Value': float('nan')})
+
+    base = broker_trades_df.groupby(
+        [BROKER_COLUMN] + dimension_columns, sort=False, observed=True, dropna=False
+    ).agg(
+        total_trades=('QTY', 'size'),
+        total_quantity=('QTY', 'sum'),
+        total_brokerage_cost=('Brokerage Amount', 'sum'),
+        total_stt=('STT', 'sum'),
+        total_cost=('Total Cost', 'sum'),  # Use calculated total cost
+        total_gross_value=('Gross Value', 'sum'),
+    ).reset_index()
+
+    def _rollup(columns):
+        if columns == [BROKER_COLUMN] + dimension_columns:
+            summary = base.copy()
+        else:
+            summary = base.groupby(columns, sort=False, observed=True, dropna=False)[SUMMARY_TOTAL_COLUMNS].sum().reset_index()
+        return _add_cost_bps(summary.rename(columns={BROKER_COLUMN: 'broker_id'}))
+
+    summaries = {'broker': _rollup([BROKER_COLUMN])}
+    for rollup in rollups:
+        summaries['_'.join(rollup)] = _rollup([BROKER_COLUMN] + [SUMMARY_DIMENSIONS[d] for d in rollup])
+    return summaries
+
+class BrokerSummaryAccumulator:
+    """Accumulate broker summary totals chunk by chunk."""
+
+    def __init__(self):
+        # broker_id -> [trades, quantity, brokerage, stt, total cost, gross value], in first-seen order
+        self.totals = {}
+
+    def update(self, broker_trades_df, sign=1):
+        """Add the totals of one chunk of broker trades, or subtract them with sign=-1."""
+        grouped = aggregate_broker_trades(broker_trades_df)['broker'][['broker_id'] + SUMMARY_TOTAL_COLUMNS]
+        for row in grouped.itertuples(index=False):
+            totals = self.totals.setdefault(row[0], [0, 0, 0.0, 0.0, 0.0, 0.0])
+            for i, value in enumerate(row[1:]):
+                totals[i] += sign * value
+
+    def to_frame(self):
+        """Return the accumulated totals in the broker summary layout."""
+        return _add_cost_bps(pd.DataFrame(
+            [[broker] + totals for broker, totals in self.totals.items()],
+            columns=['broker_id'] + SUMMARY_TOTAL_COLUMNS
+        ))
+
+@timed('report.broker_summary')
+def write_broker_summary(summary_df, output_dir, generated_at):
+    """Write an already aggregated broker summary to CSV."""
+    try:
+        summary_df['generated_at'] = generated_at
         output_path = os.path.join(output_dir, 'broker_summary.csv')
         summary_df.to_csv(output_path, index=False)
-        print(f"Generated broker summary report: {output_path}")
+        logger.info("Generated broker summary report: %s", output_path)
+        return True
+    except Exception as e:
+        logger.error("Error generating broker summary report: %s", e)
+        return False
+
+@timed('report.broker_summary')
+def generate_broker_summary(broker_trades_df, output_dir, rollups=()):
+    """
+    Generate summary report by broker.
+    Each entry of rollups (a dimension name or tuple of names from
+    SUMMARY_DIMENSIONS) also writes broker_summary_<name>.csv with totals per
+    broker and those dimensions, computed from the same grouping pass.
+    """
+    try:
+        summaries = aggregate_broker_trades(broker_trades_df, rollups)
+        generated_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        for name, summary_df in summaries.items():
+            # Add timestamp
+            summary_df['generated_at'] = generated_at
+
+            filename = 'broker_summary.csv' if name == 'broker' else f'broker_summary_{name}.csv'
+            output_path = os.path.join(output_dir, filename)
+            summary_df.to_csv(output_path, index=False)
+            logger.info("Generated broker summary report: %s", output_path)
         
         return True
     except Exception as e:
-        print(f"Error generating broker summary report: {str(e)}")
+        logger.error("Error generating broker summary report: %s", e)
+        return False
+
+def generate_reports(broker_trades_df, output_dir, fmt='csv', partition=False, rollups=(), max_workers=None):
+    """
+    Write the matched trades report and the broker summaries concurrently in
+    fmt ('csv', 'parquet' or 'feather'). With partition, matched trades are
+    split by deal date and broker and summaries by broker. Parquet and Feather
+    keep the run timestamp in file metadata instead of a generated_at column.
+    When per-trade costs are present, broker_cost_distribution is written too.
+    """
+    if broker_trades_df is None or broker_trades_df.empty:
+        logger.warning("No broker trades data available.")
+        return False
+
+    try:
+        metadata = {'generated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+        jobs = [dict(df=broker_trades_df, output_dir=output_dir, name='matched_trades', fmt=fmt, metadata=metadata,
+                     partition_cols=['Deal Date', BROKER_COLUMN] if partition else None)]
+
+        for name, summary_df in aggregate_broker_trades(broker_trades_df, rollups).items():
+            report = 'broker_summary' if name == 'broker' else f'broker_summary_{name}'
+            jobs.append(dict(df=summary_df, output_dir=output_dir, name=report, fmt=fmt, metadata=metadata,
+                             partition_cols=['broker_id'] if partition else None))
+
+        if 'Cost bps' in broker_trades_df.columns:
+            jobs.append(dict(df=broker_cost_distribution(broker_trades_df), output_dir=output_dir,
+                             name='broker_cost_distribution', fmt=fmt, metadata=metadata))
+
+        results = write_reports(jobs, max_workers)
+        return all(paths is not None for paths in results.values())
+    except Exception as e:
+        logger.error("Error generating reports: %s", e)
         return False
 
-def main():
+def main(data_dir='data', output_dir='Reports'):
     try:
-        # Define the output directory for reports
-        output_dir = r'C:\Users\Sankalp\Desktop\trade_reconciliation\Reports'
         
         # Create reports directory if it doesn't exist
         os.makedirs(output_dir, exist_ok=True)
         
         # Load data from email attachments for broker trades
-        print("Loading broker trades...")
+        logger.info("Loading broker trades...")
         
-        email_paths = [
-            r'C:\Users\Sankalp\Desktop\trade_reconciliation\data\Trade File BROKER 1 - 31_01_2025.eml',
-            r'C:\Users\Sankalp\Desktop\trade_reconciliation\data\Trade File BROKER 2 - 31_01_2025.eml',
-            r'C:\Users\Sankalp\Desktop\trade_reconciliation\data\Trade File BROKER 3 - 31_01_2025.eml'
-        ]
+        from run_reconciliation import find_email_paths
+        email_paths = find_email_paths(data_dir)
         
         # Extract broker trades from emails
         broker_trades = extract_broker_files(email_paths)
 
         if not broker_trades:
-            print("No broker trades found. Exiting report generation.")
+            logger.warning("No broker trades found. Exiting report generation.")
             return
         
-        combined_broker_trades = pd.concat(broker_trades)
+        combined_broker_trades = concat_trades(broker_trades)
 
         # Calculate costs for each trade
         combined_broker_trades = calculate_costs(combined_broker_trades)
 
         # Generate reports directly from the loaded data 
-        print("\nGenerating reports...")
+        logger.info("Generating reports...")
 
         # Generate matched trades report
         generate_matched_trades_report(combined_broker_trades, output_dir)
@@ -150,10 +295,11 @@ def main():
         # Generate broker summary report
         generate_broker_summary(combined_broker_trades, output_dir)
 
-        print("\nAll reports generated successfully!")
+        logger.info("All reports generated successfully!")
        
     except Exception as e:
-        print(f"Error in report generation: {str(e)}")
+        logger.error("Error in report generation: %s", e)
 
 if __name__ == "__main__":
-    main()
+    configure_logging()
+    main(*sys.argv[1:3])
@@ -0,0 +1,401 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+import zlib
+from collections import OrderedDict
+from io import BytesIO
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import configure_logging, count, timed
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8050
+
+# Seconds between checks of the output directory for new or updated reports
+DEFAULT_POLL_INTERVAL = 2.0
+
+# Seconds clients and the response cache may reuse a response
+DEFAULT_TTL = 30
+
+DEFAULT_LIMIT = 1000
+MAX_CACHED_RESPONSES = 512
+
+# Bytes compared before the previous end of a CSV report to tell appends from rewrites
+ANCHOR_BYTES = 4096
+
+BROKER_COLUMN = 'party code/SEBI regn code of party'
+
+# Query filters and the report columns that hold them, first match wins
+FILTER_COLUMNS = {
+    'broker': ('broker_id', BROKER_COLUMN),
+    'isin': ('Instrument ISIN', 'symbol'),
+    'status': ('status',),
+}
+
+STATUS_REASONS = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed'}
+
+READERS = {
+    '.csv': pd.read_csv,
+    '.parquet': pd.read_parquet,
+    '.feather': pd.read_feather,
+}
+
+def _signature(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+def _group_positions(values, start=0):
+    """Row positions of each distinct value, offset by start."""
+    keys = pd.Series(values).astype(str)
+    groups = keys.groupby(keys, sort=False).indices
+    return {value: positions + start for value, positions in groups.items()}
+
+class ReportDataset:
+    """
+    One report held in memory with an index of row positions per value of
+    each filter column. CSV reports that only grew since the last load are
+    extended from the previous end of file instead of being re-read.
+    """
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.df = None
+        self.signature = None
+        self.indexes = {}
+        self._header = None
+        self._offset = 0
+        self._anchor = b''  # bytes just before _offset, to tell appends from rewrites
+
+    @property
+    def version(self):
+        return '%x-%x' % self.signature
+
+    def load(self):
+        """(Re)load the whole report and rebuild its indexes."""
+        extension = os.path.splitext(self.path)[1]
+        signature = _signature(self.path)
+        if extension == '.csv':
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            # Leave a partly written last line for the next refresh
+            end = data.rfind(b'\n') + 1
+            self._header = data[:data.find(b'\n') + 1]
+            self._offset = end
+            self._anchor = data[max(end - ANCHOR_BYTES, 0):end]
+            df = pd.read_csv(BytesIO(data[:end])) if end else pd.DataFrame()
+        else:
+            df = READERS[extension](self.path)
+
+        indexes = {}
+        for name, candidates in FILTER_COLUMNS.items():
+            column = next((c for c in candidates if c in df.columns), None)
+            if column is not None:
+                indexes[name] = _group_positions(df[column].to_numpy())
+        # Swap everything in at once for requests served while a refresh runs
+        self.df, self.indexes, self.signature = df, indexes, signature
+
+    def _appended(self, signature):
+        """Bytes appended to a CSV report since it was loaded, or None if it was rewritten."""
+        if not self.path.endswith('.csv') or self._header is None or signature[1] < self._offset:
+            return None
+        with open(self.path, 'rb') as f:
+            if f.read(len(self._header)) != self._header:
+                return None
+            # A rerun rewrites the report with the same header; its rows (and timestamps) differ
+            f.seek(self._offset - len(self._anchor))
+            if f.read(len(self._anchor)) != self._anchor:
+                return None
+            tail = f.read()
+        return tail[:tail.rfind(b'\n') + 1]
+
+    def refresh(self):
+        """Bring the dataset up to date with its file. Returns True if it changed."""
+        signature = _signature(self.path)
+        if signature == self.signature:
+            return False
+        tail = self._appended(signature)
+        if tail is None or self.df is None or self.df.empty:
+            self.load()
+            return True
+
+        if tail:
+            start = len(self.df)
+            new_rows = pd.read_csv(BytesIO(self._header + tail))
+            # Rows are added before their index entries, so a concurrent select never sees missing rows
+            self.df = pd.concat([self.df, new_rows], ignore_index=True)
+            for name, candidates in FILTER_COLUMNS.items():
+                column = next((c for c in candidates if c in self.df.columns), None)
+                if column is None:
+                    continue
+                index = self.indexes.setdefault(name, {})
+                for value, positions in _group_positions(new_rows[column].to_numpy(), start).items():
+                    index[value] = np.concatenate([index[value], positions]) if value in index else positions
+            self._offset += len(tail)
+            self._anchor = (self._anchor + tail)[-ANCHOR_BYTES:]
+            count('report_server.rows_appended', len(new_rows))
+        self.signature = signature
+        return True
+
+    def select(self, filters):
+        """Row positions matching every filter (name -> list of accepted values)."""
+        positions = None
+        for name, values in filters.items():
+            if name not in self.indexes:
+                raise KeyError(name)
+            index = self.indexes[name]
+            matched = [index[v] for v in values if v in index]
+            selected = np.sort(np.concatenate(matched)) if matched else np.array([], dtype=np.int64)
+            positions = selected if positions is None else np.intersect1d(positions, selected, assume_unique=True)
+        return np.arange(len(self.df)) if positions is None else positions
+
+class ReportCache:
+    """
+    The reports of output_dir in memory, with serialised responses cached per
+    query until the report they came from changes or their TTL runs out.
+    """
+
+    def __init__(self, output_dir, ttl=DEFAULT_TTL, max_responses=MAX_CACHED_RESPONSES):
+        self.output_dir = output_dir
+        self.ttl = ttl
+        self.max_responses = max_responses
+        self.datasets = {}
+        self.responses = OrderedDict()  # query key -> (dataset version, expires at, etag, body)
+        self.pending = {}  # path -> signature seen on the previous scan
+
+    def _report_paths(self):
+        """Report files in output_dir by dataset name; partitioned report directories are not served."""
+        paths = {}
+        if not os.path.isdir(self.output_dir):
+            return paths
+        for entry in os.scandir(self.output_dir):
+            name, extension = os.path.splitext(entry.name)
+            if entry.is_file() and extension in READERS and not name.startswith('run_metrics'):
+                paths[name] = entry.path
+        return paths
+
+    @timed('report_server.refresh')
+    def refresh(self, wait_until_stable=True):
+        """
+        Load new reports and bring changed ones up to date. With
+        wait_until_stable, a file is only read once it is unchanged since the
+        previous call, so reports still being written are not picked up.
+        Returns the names of the datasets that changed.
+        """
+        changed = []
+        current = {}
+        paths = self._report_paths()
+        for name, path in paths.items():
+            try:
+                signature = _signature(path)
+            except FileNotFoundError:
+                continue
+            current[path] = signature
+            dataset = self.datasets.get(name)
+            if dataset is not None and dataset.path == path and dataset.signature == signature:
+                continue
+            if wait_until_stable and self.pending.get(path) != signature:
+                continue
+            if dataset is None or dataset.path != path:
+                dataset = ReportDataset(name, path)
+            try:
+                if dataset.refresh():
+                    self.datasets[name] = dataset
+                    changed.append(name)
+            except Exception as e:
+                logger.error("Error loading report %s: %s", path, e)
+        self.pending = current
+
+        for name in [n for n in self.datasets if n not in paths]:
+            del self.datasets[name]
+            changed.append(name)
+        if changed:
+            logger.info("Refreshed reports: %s", ', '.join(sorted(changed)))
+        return changed
+
+    def listing(self):
+        return {name: {'rows': len(dataset.df), 'version': dataset.version, 'filters': sorted(dataset.indexes)}
+                for name, dataset in sorted(dict(self.datasets).items())}
+
+    def query(self, name, filters, limit=DEFAULT_LIMIT, offset=0):
+        """
+        Return (etag, body) for a filtered page of a dataset, serialising it
+        only on a cache miss. Raises KeyError for unknown datasets or filters.
+        """
+        dataset = self.datasets[name]
+        key = (name, tuple(sorted((f, tuple(v)) for f, v in filters.items())), limit, offset)
+        now = time.monotonic()
+        cached = self.responses.get(key)
+        if cached is not None and cached[0] == dataset.version and cached[1] > now:
+            self.responses.move_to_end(key)
+            count('report_server.cache_hits')
+            return cached[2], cached[3]
+
+        count('report_server.cache_misses')
+        positions = dataset.select(filters)
+        page = dataset.df.iloc[positions[offset:offset + limit] if limit else positions[offset:]]
+        rows = page.to_json(orient='records', date_format='iso') if not page.empty else '[]'
+        body = (
+            f'{{"dataset":{json.dumps(name)},"version":"{dataset.version}","total":{len(positions)},'
+            f'"offset":{offset},"rows":{rows}}}'
+        ).encode('utf-8')
+        etag = '"%s-%08x"' % (dataset.version, zlib.crc32(repr(key).encode()))
+
+        self.responses[key] = (dataset.version, now + self.ttl, etag, body)
+        if len(self.responses) > self.max_responses:
+            self.responses.popitem(last=False)
+        return etag, body
+
+class ReportServer:
+    """
+    Local HTTP/JSON server for the reports in output_dir:
+
+        GET /datasets                   report names, row counts and filters
+        GET /datasets/<name>?broker=..&isin=..&status=..&limit=..&offset=..
+
+    Filters may be repeated or comma-separated. Responses carry an ETag and
+    Cache-Control max-age of the TTL; If-None-Match gets 304 Not Modified.
+    Reports are refreshed in the background as runs rewrite or append to them.
+    """
+
+    def __init__(self, output_dir, host=DEFAULT_HOST, port=DEFAULT_PORT, ttl=DEFAULT_TTL,
+                 poll_interval=DEFAULT_POLL_INTERVAL):
+        self.cache = ReportCache(output_dir, ttl)
+        self.host = host
+        self.port = port
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self._stop = None
+        self._refresh_lock = None
+
+    def respond(self, method, target, headers):
+        """Return (status, extra headers, body) for one request."""
+        if method not in ('GET', 'HEAD'):
+            return 405, {'Allow': 'GET, HEAD'}, self._error('method not allowed')
+
+        url = urlsplit(target)
+        parts = [p for p in url.path.split('/') if p]
+        if parts == ['health']:
+            return 200, {}, b'{"status":"ok"}'
+        if parts in ([], ['datasets']):
+            return 200, {}, json.dumps(self.cache.listing()).encode('utf-8')
+        if len(parts) != 2 or parts[0] != 'datasets':
+            return 404, {}, self._error('not found')
+
+        params = parse_qs(url.query)
+        try:
+            limit = int(params.pop('limit', [DEFAULT_LIMIT])[-1])
+            offset = int(params.pop('offset', [0])[-1])
+        except ValueError:
+            return 400, {}, self._error('limit and offset must be integers')
+        filters = {name: [v for value in values for v in value.split(',')] for name, values in params.items()}
+        unknown = [name for name in filters if name not in FILTER_COLUMNS]
+        if unknown:
+            return 400, {}, self._error(f'unknown filters: {", ".join(unknown)}')
+
+        if parts[1] not in self.cache.datasets:
+            return 404, {}, self._error(f'no report named {parts[1]}')
+        try:
+            etag, body = self.cache.query(parts[1], filters, max(limit, 0), max(offset, 0))
+        except KeyError as e:
+            return 400, {}, self._error(f'report {parts[1]} cannot be filtered by {e.args[0]}')
+
+        cache_headers = {'ETag': etag, 'Cache-Control': f'max-age={self.ttl}'}
+        if headers.get('if-none-match') == etag:
+            count('report_server.not_modified')
+            return 304, cache_headers, b''
+        return 200, cache_headers, body
+
+    @staticmethod
+    def _error(message):
+        return json.dumps({'error': message}).encode('utf-8')
+
+    async def _handle(self, reader, writer):
+        """Serve requests on one connection, keeping it open unless the client closes it."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                count('report_server.requests')
+                status, extra_headers, body = self.respond(method, target, headers)
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                response_headers = {
+                    'Content-Type': 'application/json',
+                    'Content-Length': str(len(body)),
+                    'Connection': 'keep-alive' if keep_alive else 'close',
+                    **extra_headers,
+                }
+                head = f'HTTP/1.1 {status} {STATUS_REASONS[status]}\r\n' + ''.join(
+                    f'{name}: {value}\r\n' for name, value in response_headers.items()) + '\r\n'
+                writer.write(head.encode('latin-1') + (body if method != 'HEAD' else b''))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError) as e:
+            logger.debug("Dropped connection: %s", e)
+        except asyncio.CancelledError:
+            pass  # Idle keep-alive connection closed on shutdown
+        finally:
+            writer.close()
+
+    async def refresh(self, wait_until_stable=True):
+        """Refresh the reports in a worker thread so requests keep being served meanwhile."""
+        async with self._refresh_lock:
+            return await asyncio.get_running_loop().run_in_executor(None, self.cache.refresh, wait_until_stable)
+
+    async def run(self):
+        """Serve until stop() is called."""
+        self._stop = asyncio.Event()
+        self._refresh_lock = asyncio.Lock()
+        await self.refresh(wait_until_stable=False)
+
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info("Serving reports from %s on http://%s:%d", self.cache.output_dir, self.host, self.port)
+        async with server:
+            while not self._stop.is_set():
+                try:
+                    await asyncio.wait_for(self._stop.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    await self.refresh()
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the reconciliation reports as filtered JSON views.')
+    parser.add_argument('output_dir', help='directory the reports are written to')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--ttl', type=int, default=DEFAULT_TTL, help='seconds responses may be cached')
+    parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL,
+                        help='seconds between checks for updated reports')
+    args = parser.parse_args()
+
+    configure_logging()
+    server = ReportServer(args.output_dir, args.host, args.port, args.ttl, args.poll_interval)
+    try:
+        asyncio.run(server.run())
+    except KeyboardInterrupt:
+        logger.info("Stopped serving %s", args.output_dir)
+
+if __name__ == "__main__":
+    main()
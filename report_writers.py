@@ -0,0 +1,122 @@
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from instrumentation import timer
+
+logger = logging.getLogger(__name__)
+
+REPORT_FORMATS = ('csv', 'parquet', 'feather')
+FILE_EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet', 'feather': '.feather'}
+DEFAULT_COMPRESSION = 'zstd'
+
+# Key under which run-level metadata is stored in Parquet/Feather schema metadata
+METADATA_KEY = b'trade_reconciliation'
+
+# Directory names used when partitioning by these columns
+PARTITION_ALIASES = {
+    'Deal Date': 'deal_date',
+    'party code/SEBI regn code of party': 'broker',
+    'broker_id': 'broker',
+}
+
+def _require_pyarrow(fmt):
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise ImportError(f"Writing {fmt} reports requires pyarrow (pip install pyarrow)")
+
+def _arrow_table(df, metadata):
+    """Convert df to a pyarrow Table carrying the run metadata in its schema."""
+    import pyarrow as pa
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    schema_metadata = dict(table.schema.metadata or {})
+    schema_metadata[METADATA_KEY] = json.dumps(metadata).encode()
+    return table.replace_schema_metadata(schema_metadata)
+
+def read_report_metadata(path):
+    """Return the run metadata stored in a Parquet or Feather report."""
+    import pyarrow.parquet as pq
+    import pyarrow.feather as feather
+    if path.endswith('.parquet'):
+        schema_metadata = pq.read_schema(path).metadata or {}
+    else:
+        schema_metadata = feather.read_table(path).schema.metadata or {}
+    value = schema_metadata.get(METADATA_KEY)
+    return json.loads(value) if value else {}
+
+def _write_file(df, path, fmt, metadata, compression):
+    if fmt == 'csv':
+        # CSV has no file metadata, so the run timestamp stays a column for existing consumers
+        df.assign(generated_at=metadata.get('generated_at')).to_csv(path, index=False)
+    elif fmt == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(_arrow_table(df, metadata), path, compression=compression)
+    else:
+        import pyarrow.feather as feather
+        feather.write_feather(_arrow_table(df, metadata), path, compression=compression)
+
+def _partition_value(value):
+    """Render a partition value as a safe directory name."""
+    if pd.isna(value):
+        return '__null__'
+    if isinstance(value, pd.Timestamp) and value == value.normalize():
+        return value.strftime('%Y-%m-%d')
+    return str(value).replace('/', '_').replace(os.sep, '_')
+
+def write_report(df, output_dir, name, fmt='csv', metadata=None, partition_cols=None,
+                 compression=DEFAULT_COMPRESSION):
+    """
+    Write one report in the given format and return the written paths.
+    With partition_cols the report is split into hive-style directories,
+    e.g. <name>/deal_date=2024-06-12/broker=BROKER1CODE/part-0.parquet.
+    Parquet and Feather files carry metadata in their schema instead of a column.
+    """
+    if fmt not in REPORT_FORMATS:
+        raise ValueError(f"Unknown report format: {fmt}. Expected one of {REPORT_FORMATS}")
+    if fmt != 'csv':
+        _require_pyarrow(fmt)
+
+    metadata = dict(metadata or {}, report=name)
+    extension = FILE_EXTENSIONS[fmt]
+
+    with timer(f'report.{name}'):
+        if not partition_cols:
+            path = os.path.join(output_dir, f'{name}{extension}')
+            _write_file(df.reset_index(drop=True), path, fmt, dict(metadata, rows=len(df)), compression)
+            return [path]
+
+        paths = []
+        aliases = [PARTITION_ALIASES.get(c, c) for c in partition_cols]
+        for key, part in df.groupby(partition_cols, sort=True, observed=True, dropna=False):
+            key = key if isinstance(key, tuple) else (key,)
+            directory = os.path.join(
+                output_dir, name, *(f'{alias}={_partition_value(v)}' for alias, v in zip(aliases, key))
+            )
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f'part-0{extension}')
+            _write_file(part.reset_index(drop=True), path, fmt, dict(metadata, rows=len(part)), compression)
+            paths.append(path)
+        return paths
+
+def write_reports(jobs, max_workers=None):
+    """
+    Write independent reports concurrently on a thread pool; file writing and
+    Parquet/Feather encoding release the GIL. Each job is a dict of
+    write_report keyword arguments. Returns {report name: paths or None on error}.
+    """
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(write_report, **job): job['name'] for job in jobs}
+        for future, name in futures.items():
+            try:
+                results[name] = future.result()
+                logger.info("Generated %s report: %s", name, ', '.join(results[name][:3])
+                            + (' ...' if len(results[name]) > 3 else ''))
+            except Exception as e:
+                logger.error("Error generating %s report: %s", name, e)
+                results[name] = None
+    return results
@@ -1,46 +1,318 @@
+import argparse
+import hashlib
+import json
+import logging
 import os
-import pandas as pd
-from reconcile_trades import TradeReconciliation
-from extract_trades import extract_broker_files  # Removed load_client_orders
-from report_generation import calculate_costs, generate_matched_trades_report, generate_broker_summary
-
-def automate_trade_reconciliation():
-    # Define directories for data and output
-    data_dir = r'C:\Users\Sankalp\Desktop\trade_reconciliation\data'  # Directory containing trade files
-    output_dir = r'C:\Users\Sankalp\Desktop\trade_reconciliation\Reports'  # Directory to save reports
-    
+import sys
+from datetime import datetime
+from instrumentation import RunMetrics, activate, configure_logging
+
+# pandas and the pipeline modules are imported inside the functions that need
+# them, so --help, argument errors and runs with no new input start quickly.
+
+logger = logging.getLogger(__name__)
+
+# Number of broker trade rows processed at a time in streaming mode
+DEFAULT_CHUNK_SIZE = 50000
+
+DEFAULT_DATA_DIR = 'data'
+DEFAULT_OUTPUT_DIR = 'Reports'
+
+COMMANDS = ('extract', 'reconcile', 'report', 'run-all')
+
+def find_email_paths(data_dir):
+    """Return the .eml files in data_dir, sorted by name."""
+    if not os.path.isdir(data_dir):
+        return []
+    return sorted(entry.path for entry in os.scandir(data_dir)
+                  if entry.is_file() and entry.name.lower().endswith('.eml'))
+
+def _input_fingerprint(email_paths, options=None):
+    """
+    Hash of the names, sizes and modification times of the input files and of
+    the options that change what a run writes, so rerunning with e.g. another
+    report format is not skipped.
+    """
+    digest = hashlib.sha256()
+    for path in email_paths:
+        stat = os.stat(path)
+        digest.update(f'{os.path.basename(path)}\0{stat.st_size}\0{stat.st_mtime_ns}\n'.encode())
+    digest.update(json.dumps(options or {}, sort_keys=True).encode())
+    return digest.hexdigest()
+
+def _stamp_path(output_dir, command):
+    return os.path.join(output_dir, f'.last_run_{command}.json')
+
+def _inputs_unchanged(output_dir, command, fingerprint):
+    try:
+        with open(_stamp_path(output_dir, command)) as f:
+            return json.load(f).get('fingerprint') == fingerprint
+    except (OSError, ValueError):
+        return False
+
+def _record_run(output_dir, command, fingerprint):
+    with open(_stamp_path(output_dir, command), 'w') as f:
+        json.dump({'fingerprint': fingerprint, 'finished_at': datetime.now().isoformat(timespec='seconds')}, f)
+
+def stream_trade_reconciliation(email_paths, output_dir, chunk_size=DEFAULT_CHUNK_SIZE, cache=None, store=None):
+    """
+    Process broker trades in fixed-size chunks from ingestion through cost
+    calculation to report writing, so memory does not grow with the day's volume.
+    Chunks are also appended to store (a TradeStore) when given. Attachments
+    are read twice: first for their row fingerprints, so rows restated by a
+    later file are left out as in the batch path, then for the chunks.
+    """
+    from extract_trades import iter_broker_frames, iter_broker_trade_chunks, sort_by_delivery
+    from report_generation import (calculate_costs, append_matched_trades_chunk,
+                                   BrokerSummaryAccumulator, write_broker_summary)
+    from trade_dedup import restated_rows
+
+    email_paths = sort_by_delivery(email_paths)
+    restated = restated_rows(iter_broker_frames(email_paths, cache=cache))
+
+    matched_path = os.path.join(output_dir, 'matched_trades.csv')
+    if os.path.exists(matched_path):
+        os.remove(matched_path)  # Chunks are appended, so start from an empty report
+
+    generated_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    summary = BrokerSummaryAccumulator()
+    columns = None
+    total_rows = 0
+    # One appender for the run, so fills repeated across chunks are all kept
+    appender = store.trade_appender() if store is not None else None
+
+    for chunk in iter_broker_trade_chunks(email_paths, chunk_size, cache=cache, drop=restated):
+        chunk = calculate_costs(chunk)
+        if columns is None:
+            columns = chunk.columns.tolist()
+
+        append_matched_trades_chunk(chunk, matched_path, generated_at, columns=columns)
+        summary.update(chunk)
+        if appender is not None:
+            appender.append(chunk)
+        total_rows += len(chunk)
+
+    if total_rows == 0:
+        logger.warning("No broker trades found. Exiting reconciliation.")
+        return False
+
+    logger.info("Generated matched trades report: %s (%d trades)", matched_path, total_rows)
+    write_broker_summary(summary.to_frame(), output_dir, generated_at)
+    return True
+
+def automate_trade_reconciliation(data_dir=DEFAULT_DATA_DIR, output_dir=DEFAULT_OUTPUT_DIR, command='report',
+                                  streaming=False, chunk_size=DEFAULT_CHUNK_SIZE, profile=False, trace_memory=False,
+                                  report_format='csv', partition_reports=False, store_dir=None, mode='vectorized',
+                                  force=False):
+    """
+    Run one pipeline command over the .eml files in data_dir and write a
+    run_metrics_<timestamp>.json with per-stage timers and counters next to
+    the outputs. profile enables cProfile and trace_memory records peak traced
+    memory for the run. report_format and partition_reports select the report
+    writer (streaming mode always writes CSV). With store_dir the day's broker
+    trades and reconciliation results are added to the historical trade store.
+
+    Unless force is set, the command is skipped when the input files and the
+    output options are unchanged since its last successful run. Returns True
+    if the command succeeded or was skipped that way, False if it failed.
+    """
+    if command not in COMMANDS:
+        raise ValueError(f"Unknown command: {command}. Expected one of {COMMANDS}")
+
+    email_paths = find_email_paths(data_dir)
+    if not email_paths:
+        logger.warning("No email files found in %s.", data_dir)
+        return False
+
     # Ensure output directory exists
     os.makedirs(output_dir, exist_ok=True)
-    
-    # Step 1: Load broker trades
-    print("Loading broker trades from email files...")
-    email_paths = [
-        os.path.join(data_dir, 'Trade File BROKER 1 - 31_01_2025.eml'),
-        os.path.join(data_dir, 'Trade File BROKER 2 - 31_01_2025.eml'),
-        os.path.join(data_dir, 'Trade File BROKER 3 - 31_01_2025.eml')
-    ]
-    broker_trades = extract_broker_files(email_paths)
+
+    options = {
+        'format': report_format,
+        'mode': mode,
+        'partition': partition_reports,
+        'streaming': streaming,
+        'store_dir': os.path.abspath(store_dir) if store_dir else None,
+    }
+    fingerprint = _input_fingerprint(email_paths, options)
+    if not force and _inputs_unchanged(output_dir, command, fingerprint):
+        logger.info("No new or changed files in %s and no changed options since the last %s run.",
+                    data_dir, command)
+        return True
+
+    metrics = RunMetrics(profile=profile, trace_memory=trace_memory)
+    with activate(metrics):
+        completed = _run_pipeline(email_paths, data_dir, output_dir, command, streaming, chunk_size,
+                                  report_format, partition_reports, store_dir, mode)
+    metrics.write(output_dir)
+
+    if completed:
+        _record_run(output_dir, command, fingerprint)
+    return completed
+
+def _write_reconciliation(results, output_dir, report_format):
+    from report_writers import write_reports
+
+    generated_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    jobs = [{'df': df, 'output_dir': output_dir, 'name': f'reconciliation_{name}', 'fmt': report_format,
+             'metadata': {'generated_at': generated_at}} for name, df in results.items()]
+    return all(paths is not None for paths in write_reports(jobs).values())
+
+def _order_costs(results, broker_trades, client_orders):
+    """VWAP, explicit cost and slippage per order from the matched and excess fills."""
+    from cost_analytics import fill_costs, order_costs
+    from trade_schema import concat_trades
+
+    fills = [df for df in (results['matched'], results['excess']) if not df.empty]
+    if not fills or 'UCC' not in broker_trades.columns:
+        return None
+    return order_costs(fill_costs(concat_trades(fills, ignore_index=True), broker_trades, client_orders))
+
+def _run_pipeline(email_paths, data_dir, output_dir, command='report', streaming=False, chunk_size=DEFAULT_CHUNK_SIZE,
+                  report_format='csv', partition_reports=False, store_dir=None, mode='vectorized'):
+    from attachment_cache import AttachmentCache
+    from trade_store import TradeStore
+
+    # Parsed attachments are cached so unchanged files are not re-read on every run
+    cache = AttachmentCache(os.path.join(data_dir, '.attachment_cache'))
+    store = TradeStore(store_dir) if store_dir else None
+
+    if streaming and command == 'report':
+        completed = stream_trade_reconciliation(email_paths, output_dir, chunk_size, cache=cache, store=store)
+        if completed:
+            logger.info("All reports generated successfully!")
+        return completed
+
+    from extract_trades import ingest_emails, sort_by_delivery
+    from trade_dedup import drop_restated
+    from trade_schema import concat_trades
+
+    # Step 1: Load client orders and broker trades, in the order the emails were sent
+    logger.info("Loading trades from %d email files...", len(email_paths))
+    client_orders, broker_trades = ingest_emails(sort_by_delivery(email_paths), cache=cache)
+    # A resent or restated file replaces the earlier file it restates
+    broker_trades = drop_restated(broker_trades)
     if not broker_trades:
-        print("No broker trades found. Exiting reconciliation.")
-        return
-    
+        logger.warning("No broker trades found. Exiting reconciliation.")
+        return False
+
     # Combine all broker trades into a single DataFrame
-    combined_broker_trades = pd.concat(broker_trades)
-    
-    # Step 2: Calculate costs for broker trades
-    print("Calculating costs for broker trades...")
+    combined_broker_trades = concat_trades(broker_trades)
+
+    if command == 'extract':
+        from report_writers import write_reports
+        generated_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        jobs = [{'df': df, 'output_dir': output_dir, 'name': name, 'fmt': report_format,
+                 'metadata': {'generated_at': generated_at}}
+                for name, df in (('client_orders', client_orders), ('broker_trades', combined_broker_trades))
+                if df is not None]
+        return all(paths is not None for paths in write_reports(jobs).values())
+
+    # Step 2: Reconcile client orders against broker trades
+    if command in ('reconcile', 'run-all'):
+        from reconcile_trades import TradeReconciliation
+        if client_orders is None:
+            logger.warning("No client orders found. Skipping reconciliation.")
+            if command == 'reconcile':
+                return False
+        else:
+            from trade_schema import check_client_orders, to_matching_layout
+            try:
+                # Broker files come in their own layout; derive the columns orders are matched on
+                check_client_orders(client_orders)
+                matching_trades = to_matching_layout(combined_broker_trades)
+            except ValueError as e:
+                logger.error("Cannot reconcile: %s", e)
+                return False
+
+            logger.info("Reconciling %d client orders...", len(client_orders))
+            reconciler = TradeReconciliation(client_orders, matching_trades, mode=mode)
+            reconciler.reconcile()
+            results = reconciler.get_results()
+            if store is not None:
+                store.append_results(results, matching_trades, client_orders, replace=mode != 'incremental')
+            costs = _order_costs(results, matching_trades, client_orders)
+            if costs is not None:
+                results['order_costs'] = costs
+            if not _write_reconciliation(results, output_dir, report_format):
+                return False
+        if command == 'reconcile':
+            return True
+
+    from report_generation import calculate_costs, generate_reports
+
+    # Step 3: Calculate costs for broker trades
+    logger.info("Calculating costs for broker trades...")
     combined_broker_trades = calculate_costs(combined_broker_trades)
-    
-    # Step 3: Generate reports
-    print("Generating reports...")
-    
-    # Generate matched trades report
-    generate_matched_trades_report(combined_broker_trades, output_dir)
-    
-    # Generate broker summary report
-    generate_broker_summary(combined_broker_trades, output_dir)
-    
-    print("\nAll reports generated successfully!")
+    if store is not None:
+        store.append_trades(combined_broker_trades)
+
+    # Step 4: Generate reports
+    logger.info("Generating reports...")
+
+    # Generate matched trades and broker summary reports concurrently
+    if generate_reports(combined_broker_trades, output_dir, fmt=report_format, partition=partition_reports):
+        logger.info("All reports generated successfully!")
+        return True
+    return False
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='run_reconciliation',
+                                     description='Reconcile client orders against broker trade emails.')
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='directory containing the .eml trade files')
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR, help='directory to write outputs to')
+    parser.add_argument('--format', dest='report_format', choices=('csv', 'parquet', 'feather'), default='csv',
+                        help='output file format')
+    parser.add_argument('--force', action='store_true', help='run even if the input files are unchanged')
+    parser.add_argument('--profile', action='store_true', help='record a cProfile of the run')
+    parser.add_argument('--trace-memory', action='store_true', help='record peak traced memory')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log debug messages')
+
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    subparsers.add_parser('extract', help='parse the emails and write client orders and broker trades')
+
+    reconcile = subparsers.add_parser('reconcile', help='match client orders against broker trades')
+    report = subparsers.add_parser('report', help='calculate costs and write the trade reports')
+    run_all = subparsers.add_parser('run-all', help='reconcile, then write the trade reports')
+
+    for sub in (reconcile, run_all):
+        # Modes are listed here rather than imported so parsing stays import-free
+        sub.add_argument('--mode', choices=('loop', 'vectorized'), default='vectorized', help='matching engine')
+    report.add_argument('--streaming', action='store_true', help='process broker trades in chunks')
+    report.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='rows per chunk when streaming')
+    for sub in (report, run_all):
+        sub.add_argument('--partition', action='store_true', help='partition reports by deal date and broker')
+    for sub in (reconcile, report, run_all):
+        sub.add_argument('--store-dir', default=None,
+                         help='append broker trades and reconciliation results to this trade store')
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    configure_logging(logging.DEBUG if args.verbose else logging.INFO)
+
+    # Without a subcommand the script keeps its old behaviour of running the reports
+    command = args.command or 'report'
+    try:
+        completed = automate_trade_reconciliation(
+            data_dir=args.data_dir,
+            output_dir=args.output_dir,
+            command=command,
+            streaming=getattr(args, 'streaming', False),
+            chunk_size=getattr(args, 'chunk_size', DEFAULT_CHUNK_SIZE),
+            profile=args.profile,
+            trace_memory=args.trace_memory,
+            report_format=args.report_format,
+            partition_reports=getattr(args, 'partition', False),
+            store_dir=getattr(args, 'store_dir', None),
+            mode=getattr(args, 'mode', 'vectorized'),
+            force=args.force,
+        )
+    except Exception:
+        logger.exception("The %s run failed.", command)
+        return 1
+    # A non-zero exit status lets schedulers detect failed runs
+    return 0 if completed else 1
 
 if __name__ == "__main__":
-    automate_trade_reconciliation()
+    sys.exit(main())
@@ -0,0 +1,111 @@
+import os
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from io import BytesIO
+from trade_schema import BROKER_FILE_COLUMNS
+
+
+XLSX_MIME_SUBTYPE = 'vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+def _random_isins(rng, n_instruments):
+    """Build ISIN-like identifiers such as INE123A01012."""
+    digits = rng.integers(0, 1000, n_instruments)
+    letters = rng.choice(list('ABCDEFGHJKLMNPQRSTUVWXYZ'), n_instruments)
+    checks = rng.integers(10, 100, n_instruments)
+    return np.array([f"INE{d:03d}{l}010{c:02d}" for d, l, c in zip(digits, letters, checks)])
+
+def generate_broker_trades(n_trades, n_brokers=3, n_instruments=500, n_days=1,
+                           start_date='2024-06-12', seed=0):
+    """
+    Generate broker fills in the broker trade file layout.
+    Returns one DataFrame per broker, with trades spread over n_days.
+    """
+    rng = np.random.default_rng(seed)
+    isins = _random_isins(rng, n_instruments)
+    prices = rng.uniform(50, 5000, n_instruments).round(2)
+
+    instrument = rng.integers(0, n_instruments, n_trades)
+    quantity = rng.integers(1, 300, n_trades) * rng.choice([1, 5, 10, 30], n_trades)
+    cost = (prices[instrument] * rng.normal(1, 0.002, n_trades)).round(4)
+    value = quantity * cost
+    brokerage = (value * rng.uniform(0.0001, 0.0005, n_trades)).round(4)
+    stt = (value * 0.001).round(0)
+
+    start = datetime.strptime(start_date, '%Y-%m-%d')
+    deal_dates = np.array([start + timedelta(days=int(d)) for d in rng.integers(0, n_days, n_trades)])
+
+    trades = pd.DataFrame({
+        'Deal Date': pd.to_datetime(deal_dates),
+        'party code/SEBI regn code of party': [f'BROKER{b + 1}CODE' for b in rng.integers(0, n_brokers, n_trades)],
+        'Instrument ISIN': isins[instrument],
+        'Buy/Sell Flag': rng.choice(['B', 'S'], n_trades),
+        'QTY': quantity,
+        'COST': cost,
+        'Col 8': np.nan,
+        'NET AMOUNT': (value + brokerage).round(4),
+        'Brokerage Amount': brokerage,
+        'Settlement Date': pd.to_datetime(deal_dates) + pd.Timedelta(days=1),
+        'STT': stt,
+        'Exchange Code': rng.choice(['NSE', 'BSE'], n_trades, p=[0.9, 0.1]),
+        'Depository Code': rng.choice(['NSDL', 'CDSL'], n_trades, p=[0.8, 0.2]),
+    }, columns=BROKER_FILE_COLUMNS)
+
+    return [df.reset_index(drop=True) for _, df in trades.groupby('party code/SEBI regn code of party', sort=True)]
+
+def generate_client_orders(broker_trades_df, pending_ratio=0.05, seed=0):
+    """
+    Derive client orders from broker fills in the matching layout: one order
+    per (Ticker, Direction, Date) sized around the filled quantity, so the
+    result mixes full, partial and excess fills, plus some orders with no fills.
+    """
+    rng = np.random.default_rng(seed)
+    filled = broker_trades_df.groupby(['Ticker', 'Direction', 'Date'], sort=False, observed=True)['Quantity'].sum()
+    quantity = (filled.to_numpy() * rng.choice([0.8, 1.0, 1.0, 1.2], len(filled))).round().astype('int64')
+
+    orders = filled.reset_index()[['Ticker', 'Direction', 'Date']]
+    orders['Quantity'] = quantity
+
+    n_pending = int(len(orders) * pending_ratio)
+    if n_pending:
+        pending = orders.sample(n_pending, random_state=seed).copy()
+        pending['Direction'] = pending['Direction'].map({'B': 'S', 'S': 'B'})
+        orders = pd.concat([orders, pending], ignore_index=True)
+
+    orders.insert(0, 'UCC', [f'C{i}' for i in range(len(orders))])
+    return orders[['UCC', 'Ticker', 'Quantity', 'Direction', 'Date']]
+
+def _excel_bytes(df):
+    buffer = BytesIO()
+    df.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+def write_trade_emails(broker_frames, output_dir, client_orders=None, file_date='31_01_2025'):
+    """
+    Write one .eml per broker with a TradeFile<n>.xlsx attachment, named like
+    the real broker emails. Client orders, if given, are attached to the first
+    email as ClientOrders.xlsx. Returns the list of email paths.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    email_paths = []
+
+    for i, broker_df in enumerate(broker_frames, 1):
+        msg = EmailMessage()
+        msg['Subject'] = f'Trade File BROKER {i} - {file_date}'
+        msg['From'] = f'broker{i}@example.com'
+        msg['To'] = 'operations@example.com'
+        msg.set_content(f'Please find attached the trade file for {file_date}.')
+        msg.add_attachment(_excel_bytes(broker_df), maintype='application',
+                           subtype=XLSX_MIME_SUBTYPE, filename=f'TradeFile{i}.xlsx')
+
+        if client_orders is not None and i == 1:
+            msg.add_attachment(_excel_bytes(client_orders), maintype='application',
+                               subtype=XLSX_MIME_SUBTYPE, filename='ClientOrders.xlsx')
+
+        path = os.path.join(output_dir, f'Trade File BROKER {i} - {file_date}.eml')
+        with open(path, 'wb') as f:
+            f.write(msg.as_bytes())
+        email_paths.append(path)
+
+    return email_paths
@@ -0,0 +1,35 @@
+import pandas as pd
+import pytest
+
+from batch_reconciliation import reconcile_sharded
+from reconcile_trades import TradeReconciliation
+from synthetic_data import generate_broker_trades, generate_client_orders
+from trade_schema import concat_trades, normalize_broker_trades, to_matching_layout
+
+
+@pytest.fixture(scope='module')
+def days():
+    frames = generate_broker_trades(2000, n_instruments=80, n_days=3, seed=5)
+    trades = to_matching_layout(concat_trades([normalize_broker_trades(df) for df in frames], ignore_index=True))
+    return generate_client_orders(trades, seed=5), trades
+
+
+def _sorted(df):
+    return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+
+@pytest.mark.parametrize('order_unit, trade_unit', [('us', 'us'), ('ns', 'us'), ('s', 'ns')])
+def test_sharded_matches_unsharded(days, order_unit, trade_unit):
+    # pd.read_excel and xlsx_reader may return dates in different units
+    client_orders, broker_trades = days
+    client_orders = client_orders.assign(Date=client_orders['Date'].astype(f'datetime64[{order_unit}]'))
+    broker_trades = broker_trades.assign(Date=broker_trades['Date'].astype(f'datetime64[{trade_unit}]'))
+
+    reconciler = TradeReconciliation(client_orders, broker_trades, mode='vectorized')
+    reconciler.reconcile()
+    expected = reconciler.get_results()
+    actual = reconcile_sharded(client_orders, broker_trades, n_shards=8, max_workers=1)
+
+    assert not expected['matched'].empty
+    for name in ('matched', 'unmatched', 'excess'):
+        pd.testing.assert_frame_equal(_sorted(actual[name]), _sorted(expected[name]), check_dtype=False)
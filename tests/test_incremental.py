@@ -0,0 +1,47 @@
+import pandas as pd
+import pytest
+
+from matching_engine import ROW_COLUMNS
+from reconcile_trades import TradeReconciliation, close_connections
+from synthetic_data import generate_broker_trades, generate_client_orders
+from trade_schema import concat_trades, normalize_broker_trades, to_matching_layout
+
+
+@pytest.fixture(scope='module')
+def day():
+    frames = generate_broker_trades(800, n_instruments=60, seed=6)
+    trades = to_matching_layout(concat_trades([normalize_broker_trades(df) for df in frames], ignore_index=True))
+    # A fill that really repeats within a batch must still be applied twice
+    trades = pd.concat([trades.iloc[:6], trades.iloc[[5]], trades.iloc[6:]], ignore_index=True)
+    return generate_client_orders(trades, seed=6), trades
+
+
+def _fills(results):
+    fills = concat_trades([results['matched'], results['excess']], ignore_index=True)
+    fills = fills.drop(columns=ROW_COLUMNS)
+    return fills.sort_values(list(fills.columns)).reset_index(drop=True)
+
+
+def test_repeated_batch_is_applied_once(day, tmp_path):
+    client_orders, broker_trades = day
+    state_db = str(tmp_path / 'state.db')
+    half = len(broker_trades) // 2
+    batches = [broker_trades.iloc[:half], broker_trades.iloc[half:], broker_trades.iloc[half:]]
+
+    runs = []
+    try:
+        for batch in batches:
+            reconciler = TradeReconciliation(client_orders, batch, mode='incremental', state_db=state_db)
+            reconciler.reconcile()
+            runs.append(reconciler.get_results())
+    finally:
+        close_connections()
+
+    repeated = runs[-1]
+    assert repeated['matched'].empty and repeated['excess'].empty
+
+    full = TradeReconciliation(client_orders, broker_trades, mode='loop')
+    full.reconcile()
+    incremental = {name: concat_trades([run[name] for run in runs if not run[name].empty], ignore_index=True)
+                   for name in ('matched', 'excess')}
+    pd.testing.assert_frame_equal(_fills(incremental), _fills(full.get_results()), check_dtype=False)
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from reconcile_trades import TradeReconciliation
+from synthetic_data import generate_broker_trades, generate_client_orders
+from trade_schema import concat_trades, normalize_broker_trades, to_matching_layout
+
+
+def _reconcile(client_orders, broker_trades, mode):
+    reconciler = TradeReconciliation(client_orders, broker_trades, mode=mode)
+    reconciler.reconcile()
+    return reconciler.get_results()
+
+
+def assert_modes_agree(client_orders, broker_trades):
+    """The row loop and the vectorized engine give the same rows in the same order."""
+    expected = _reconcile(client_orders, broker_trades, 'loop')
+    actual = _reconcile(client_orders, broker_trades, 'vectorized')
+    for name in ('matched', 'unmatched', 'excess'):
+        if expected[name].empty:
+            # The loop builds empty results without columns
+            assert actual[name].empty, name
+            continue
+        pd.testing.assert_frame_equal(
+            expected[name].reset_index(drop=True), actual[name].reset_index(drop=True), check_dtype=False
+        )
+    return expected
+
+
+@pytest.fixture(scope='module')
+def broker_trades():
+    frames = generate_broker_trades(1500, n_instruments=150, n_days=2, seed=1)
+    return to_matching_layout(concat_trades([normalize_broker_trades(df) for df in frames], ignore_index=True))
+
+
+@pytest.fixture(scope='module')
+def client_orders(broker_trades):
+    return generate_client_orders(broker_trades, seed=1)
+
+
+def test_synthetic_day(client_orders, broker_trades):
+    results = assert_modes_agree(client_orders, broker_trades)
+    assert not results['matched'].empty
+    assert not results['unmatched'].empty
+    assert not results['excess'].empty
+
+
+def test_duplicate_key_orders(client_orders, broker_trades):
+    # Several orders per (Ticker, Direction, Date), each seeing all trades of the key
+    split = client_orders.assign(Quantity=client_orders['Quantity'] // 2)
+    orders = pd.concat([client_orders, split, client_orders.iloc[::3]], ignore_index=True)
+    orders['UCC'] = [f'C{i}' for i in range(len(orders))]
+    assert_modes_agree(orders, broker_trades)
+
+
+@pytest.mark.parametrize('quantity', [0, -50])
+def test_zero_and_negative_quantities(client_orders, broker_trades, quantity):
+    rng = np.random.default_rng(2)
+    orders = client_orders.copy()
+    trades = broker_trades.copy()
+    orders.loc[rng.random(len(orders)) < 0.1, 'Quantity'] = quantity
+    trades.loc[rng.random(len(trades)) < 0.1, 'Quantity'] = quantity
+    assert_modes_agree(orders, trades)
+
+
+def test_missing_keys(client_orders, broker_trades):
+    # Orders and trades with a missing Ticker or Date never match
+    rng = np.random.default_rng(3)
+    orders = client_orders.astype({'Ticker': object})
+    trades = broker_trades.astype({'Ticker': object})
+    orders.loc[rng.random(len(orders)) < 0.1, 'Ticker'] = np.nan
+    orders.loc[rng.random(len(orders)) < 0.1, 'Date'] = pd.NaT
+    trades.loc[rng.random(len(trades)) < 0.1, 'Ticker'] = np.nan
+    trades.loc[rng.random(len(trades)) < 0.1, 'Date'] = pd.NaT
+    results = assert_modes_agree(orders, trades)
+    missing = orders['Ticker'].isna() | orders['Date'].isna()
+    assert set(orders.loc[missing, 'UCC']) <= set(results['unmatched']['order_id'])
@@ -0,0 +1,54 @@
+import sqlite3
+
+import pytest
+
+from reconcile_trades import TradeReconciliation, TABLE_COLUMNS, close_connections
+from synthetic_data import generate_broker_trades, generate_client_orders
+from trade_schema import concat_trades, normalize_broker_trades, to_matching_layout
+
+
+@pytest.fixture(scope='module')
+def day():
+    frames = generate_broker_trades(300, n_instruments=40, seed=4)
+    trades = to_matching_layout(concat_trades([normalize_broker_trades(df) for df in frames], ignore_index=True))
+    return generate_client_orders(trades, seed=4), trades
+
+
+def _row_counts(db_name):
+    conn = sqlite3.connect(db_name)
+    try:
+        return {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in TABLE_COLUMNS}
+    finally:
+        conn.close()
+
+
+def _save(client_orders, broker_trades, db_name, mode='vectorized'):
+    reconciler = TradeReconciliation(client_orders, broker_trades, mode=mode, state_db=db_name)
+    reconciler.reconcile()
+    run_id = reconciler.save_to_database(db_name)
+    close_connections()
+    return run_id
+
+
+def test_saving_the_same_day_again_replaces_its_rows(day, tmp_path):
+    client_orders, broker_trades = day
+    db_name = str(tmp_path / 'trades.db')
+
+    first = _save(client_orders, broker_trades, db_name)
+    counts = _row_counts(db_name)
+    second = _save(client_orders, broker_trades, db_name)
+
+    assert first == second
+    assert _row_counts(db_name) == counts
+    assert counts['broker_trades'] == len(broker_trades)
+
+
+def test_other_modes_and_brokers_keep_their_rows(day, tmp_path):
+    client_orders, broker_trades = day
+    db_name = str(tmp_path / 'trades.db')
+
+    ids = {_save(client_orders, broker_trades, db_name, mode='loop'),
+           _save(client_orders, broker_trades, db_name, mode='vectorized'),
+           _save(client_orders, broker_trades.iloc[:100], db_name)}
+    assert _row_counts(db_name)['broker_trades'] == 2 * len(broker_trades) + 100
+    assert len(ids) == 3
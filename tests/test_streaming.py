@@ -0,0 +1,32 @@
+import os
+
+import pandas as pd
+import pytest
+
+from run_reconciliation import stream_trade_reconciliation
+from synthetic_data import generate_broker_trades, write_trade_emails
+
+
+@pytest.fixture
+def restated_day(tmp_path):
+    frames = generate_broker_trades(600, n_instruments=60, seed=7)
+    # The first broker resends its file later in the day with one fill corrected
+    restated = frames[0].copy()
+    restated.loc[0, 'QTY'] += 10
+    email_paths = write_trade_emails(frames + [restated], str(tmp_path / 'emails'))
+    for delivered, path in enumerate(email_paths):
+        os.utime(path, (1_700_000_000 + delivered, 1_700_000_000 + delivered))
+    return frames, email_paths
+
+
+def test_streaming_drops_restated_rows(restated_day, tmp_path):
+    frames, email_paths = restated_day
+    output_dir = tmp_path / 'reports'
+    output_dir.mkdir()
+
+    # Paths sorted by name put the resent file before the one it restates
+    assert stream_trade_reconciliation(sorted(email_paths, reverse=True), str(output_dir), chunk_size=64)
+
+    matched = pd.read_csv(output_dir / 'matched_trades.csv')
+    assert len(matched) == sum(len(df) for df in frames)
+    assert matched['QTY'].sum() == sum(df['QTY'].sum() for df in frames) + 10
@@ -0,0 +1,60 @@
+import os
+
+import pandas as pd
+import pytest
+
+from extract_trades import extract_excel_from_email, ingest_emails
+from reconcile_trades import TradeReconciliation, close_connections
+from synthetic_data import generate_broker_trades, generate_client_orders, write_trade_emails
+from trade_schema import concat_trades, normalize_broker_trades, to_matching_layout
+from watch_service import ReconciliationService
+
+
+@pytest.fixture(scope='module')
+def email_paths(tmp_path_factory):
+    # Broker files in their own layout, client orders attached to the first email
+    frames = generate_broker_trades(600, n_instruments=60, seed=3)
+    trades = to_matching_layout(concat_trades([normalize_broker_trades(df) for df in frames], ignore_index=True))
+    orders = generate_client_orders(trades, seed=3)
+    return write_trade_emails(frames, str(tmp_path_factory.mktemp('emails')), client_orders=orders)
+
+
+def _batch_filled_quantity(email_paths):
+    client_orders, broker_trades = ingest_emails(email_paths)
+    reconciler = TradeReconciliation(client_orders, to_matching_layout(concat_trades(broker_trades, ignore_index=True)))
+    reconciler.reconcile()
+    results = reconciler.get_results()
+    return results['matched']['matched_quantity'].sum() + results['excess']['matched_quantity'].sum()
+
+
+@pytest.mark.parametrize('delivery', [[0, 1, 2], [2, 1, 0]], ids=['orders first', 'orders last'])
+def test_service_matches_batch(email_paths, tmp_path, delivery):
+    service = ReconciliationService(os.path.dirname(email_paths[0]), str(tmp_path), cache_dir=str(tmp_path / 'cache'))
+    service._reset_reports()
+    try:
+        for i in delivery:
+            service.apply(email_paths[i], *extract_excel_from_email(email_paths[i]))
+    finally:
+        close_connections()
+
+    fills = pd.read_csv(tmp_path / 'reconciliation_results.csv')
+    assert fills['matched_quantity'].sum() == _batch_filled_quantity(email_paths)
+
+
+def test_changed_trades_are_not_matched_again(email_paths, tmp_path):
+    service = ReconciliationService(os.path.dirname(email_paths[0]), str(tmp_path), cache_dir=str(tmp_path / 'cache'))
+    service._reset_reports()
+    # The first broker resends its file with a few fills corrected before the others deliver
+    _, broker_trades = extract_excel_from_email(email_paths[0])
+    restated = broker_trades[0].copy()
+    restated.loc[:4, 'QTY'] += 10
+    try:
+        service.apply(email_paths[0], *extract_excel_from_email(email_paths[0]))
+        assert service.apply('resent.eml', [], [restated])
+        for path in email_paths[1:]:
+            service.apply(path, *extract_excel_from_email(path))
+    finally:
+        close_connections()
+
+    fills = pd.read_csv(tmp_path / 'reconciliation_results.csv')
+    assert fills['matched_quantity'].sum() == _batch_filled_quantity(email_paths)
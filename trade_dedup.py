@@ -0,0 +1,273 @@
+import hashlib
+import logging
+import uuid
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import count, timed
+from reconcile_trades import get_connection
+from trade_schema import BROKER_FILE_COLUMNS, normalize_broker_trades, concat_trades
+
+logger = logging.getLogger(__name__)
+
+BROKER_COLUMN = 'party code/SEBI regn code of party'
+
+# Files are compared within one (Deal Date, broker)
+SCOPE_COLUMNS = ['Deal Date', BROKER_COLUMN]
+
+# A later file restates an earlier one for the same (Deal Date, broker) when at
+# least this share of the earlier file's rows reappear in it unchanged. Separate
+# files for the same day (per exchange, intraday increments) share no rows.
+RESTATEMENT_OVERLAP = 0.5
+
+# Changed fills are paired with their previous version by instrument and side
+PAIR_COLUMNS = ['Instrument ISIN', 'Buy/Sell Flag']
+
+# Values of the change column: NEW and CHANGED rows carry current values,
+# REPLACED (the previous version of a CHANGED row) and CANCELLED rows prior ones
+CHANGE_TYPES = ('NEW', 'CHANGED', 'REPLACED', 'CANCELLED')
+ADDED_CHANGES = ('NEW', 'CHANGED')
+REMOVED_CHANGES = ('REPLACED', 'CANCELLED')
+
+def _string_hashes(series):
+    """Hash of each value's str form, computed once per category for categoricals."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        categories = np.append(series.cat.categories.astype(str).to_numpy(dtype=object), 'nan')
+        return pd.util.hash_array(categories)[series.cat.codes.to_numpy()]  # code -1 picks 'nan'
+    return pd.util.hash_array(series.astype(str).to_numpy(dtype=object))
+
+def row_fingerprints(broker_trades_df, columns=None):
+    """
+    Stable 64-bit fingerprint of each row over the broker file columns.
+    Values are canonicalised first (dates to nanoseconds, numbers to float64,
+    text to a hash of its str form) so the same fill hashes the same whether it
+    came from the fast reader, pd.read_excel or the attachment cache.
+    """
+    columns = columns or [c for c in BROKER_FILE_COLUMNS if c in broker_trades_df.columns]
+    canonical = {}
+    for column in columns:
+        series = broker_trades_df[column]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            canonical[column] = series.astype('datetime64[ns]').to_numpy().view(np.int64)
+        elif pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            canonical[column] = series.to_numpy(dtype=np.float64)
+        else:
+            canonical[column] = _string_hashes(series)
+    hashes = pd.util.hash_pandas_object(pd.DataFrame(canonical), index=False).to_numpy()
+    return hashes.view(np.int64)  # SQLite integers are signed
+
+def _scope_keys(broker_trades_df):
+    deal_date, broker = SCOPE_COLUMNS
+    # Format each distinct date once
+    dates = broker_trades_df[deal_date]
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates)
+    codes, dates = pd.factorize(dates)
+    labels = np.append(pd.DatetimeIndex(dates).strftime('%Y-%m-%d').to_numpy(dtype=object), 'NaT')
+    brokers = broker_trades_df[broker]
+    if isinstance(brokers.dtype, pd.CategoricalDtype):
+        broker_labels = np.append(brokers.cat.categories.astype(str).to_numpy(dtype=object), 'nan')
+        brokers = broker_labels[brokers.cat.codes.to_numpy()]
+    else:
+        brokers = brokers.astype(str).to_numpy(dtype=object)
+    return pd.DataFrame({'deal_date': labels[codes], 'broker': brokers})
+
+def _digest(hashes):
+    """Order-independent digest of a scope's row fingerprints."""
+    return hashlib.sha1(np.sort(hashes).tobytes()).hexdigest()
+
+def _occurrences(df, columns):
+    """Number each row among the earlier rows with the same values in columns."""
+    return df.groupby(columns, sort=False, observed=True, dropna=False).cumcount().to_numpy()
+
+def fingerprint_keys(hashes):
+    """Fingerprints numbered per value, so identical fills count as separate rows."""
+    return pd.MultiIndex.from_arrays([hashes, _occurrences(pd.DataFrame({'h': hashes}), ['h'])])
+
+def _overlap(earlier_keys, later_keys):
+    """Share of the earlier file's rows that reappear unchanged in the later one."""
+    return earlier_keys.isin(later_keys).mean() if len(earlier_keys) else 0.0
+
+def restated_rows(broker_frames, overlap=RESTATEMENT_OVERLAP):
+    """
+    Boolean mask per frame of the rows a later frame restates (see
+    drop_restated). broker_frames may be any iterable in delivery order; only
+    fingerprints are kept between frames, so they can be read one at a time.
+    """
+    drop = []
+    statements = {}  # scope -> [(frame index, row positions, fingerprint keys)] not yet restated
+    for i, df in enumerate(broker_frames):
+        drop.append(np.zeros(len(df), dtype=bool))
+        hashes = row_fingerprints(df)
+        for scope, positions in _scope_keys(df).groupby(['deal_date', 'broker'], sort=False).indices.items():
+            keys = fingerprint_keys(hashes[positions])
+            live = statements.setdefault(scope, [])
+            for statement in list(live):
+                earlier, earlier_positions, earlier_keys = statement
+                if _overlap(earlier_keys, keys) >= overlap:
+                    drop[earlier][earlier_positions] = True
+                    live.remove(statement)
+            live.append((i, positions, keys))
+
+    n_dropped = int(sum(dropped.sum() for dropped in drop))
+    if n_dropped:
+        logger.info("Dropped %d broker trade rows restated by later files", n_dropped)
+        count('restated_rows_dropped', n_dropped)
+    return drop
+
+def drop_restated(broker_frames, overlap=RESTATEMENT_OVERLAP):
+    """
+    Drop the rows of a file that a later file restates, so a resent or
+    restated file replaces the earlier one instead of being counted twice.
+    Frames must be in delivery order (see extract_trades.sort_by_delivery).
+    Within each (Deal Date, broker) a later frame restates an earlier one
+    only when their row fingerprints overlap by at least overlap; other
+    files for the same day and broker are kept.
+    """
+    drop = restated_rows(broker_frames, overlap)
+    kept = [df[~dropped] if dropped.any() else df for df, dropped in zip(broker_frames, drop)]
+    return [df for df in kept if not df.empty]
+
+class TradeDeduplicator:
+    """
+    Persistent change detection for broker trade files. The fingerprints and
+    rows of every file seen so far are kept in SQLite per (Deal Date, broker)
+    statement, with one digest per statement so an identical resend is
+    recognised without reading its rows back; diff() returns only what changed.
+    """
+
+    def __init__(self, state_db='trade_fingerprints.db', overlap=RESTATEMENT_OVERLAP):
+        self.state_db = state_db
+        self.overlap = overlap
+
+    @staticmethod
+    def _create_tables(conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS trade_fingerprints (
+                deal_date TEXT,
+                broker TEXT,
+                statement TEXT,
+                content_hash INTEGER,
+                row_json TEXT
+            )
+        ''')
+        # Databases written before files were kept apart hold one statement per scope
+        existing = {row[1] for row in conn.execute('PRAGMA table_info(trade_fingerprints)')}
+        if 'statement' not in existing:
+            conn.execute('ALTER TABLE trade_fingerprints ADD COLUMN statement TEXT')
+            conn.execute("UPDATE trade_fingerprints SET statement = deal_date || '/' || broker")
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_trade_fingerprints_scope ON trade_fingerprints (deal_date, broker)')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS trade_statements (
+                deal_date TEXT,
+                broker TEXT,
+                statement TEXT,
+                digest TEXT,
+                PRIMARY KEY (deal_date, broker, statement)
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_trade_statements_digest ON trade_statements (digest)')
+
+    @timed('dedup')
+    def diff(self, broker_trades_df):
+        """
+        Return the rows of broker_trades_df that are NEW or CHANGED, plus the
+        REPLACED and CANCELLED rows of the stored file it restates, with a
+        change column. Unchanged rows are dropped, so a resent file yields an
+        empty frame. A file that restates no stored file is all NEW and is
+        stored alongside the others for its (Deal Date, broker).
+        """
+        df = broker_trades_df.reset_index(drop=True)
+        hashes = row_fingerprints(df)
+        scopes = _scope_keys(df)
+
+        conn = get_connection(self.state_db)
+        self._create_tables(conn)
+        parts = []
+        with conn:
+            for (deal_date, broker), positions in scopes.groupby(['deal_date', 'broker'], sort=False).indices.items():
+                current = hashes[positions]
+                digest = _digest(current)
+
+                # The common case of an identical resend needs only the digest
+                if conn.execute(
+                    'SELECT 1 FROM trade_statements WHERE deal_date = ? AND broker = ? AND digest = ?',
+                    (deal_date, broker, digest)
+                ).fetchone() is not None:
+                    count('dedup_unchanged_rows', len(current))
+                    continue
+
+                stored = {}
+                for statement, content_hash in conn.execute(
+                    'SELECT statement, content_hash FROM trade_fingerprints '
+                    'WHERE deal_date = ? AND broker = ? ORDER BY rowid',
+                    (deal_date, broker)
+                ):
+                    stored.setdefault(statement, []).append(content_hash)
+
+                # Diff against the stored file this one restates, if any
+                current_keys = fingerprint_keys(current)
+                restated, restated_hashes, best = None, np.array([], dtype=np.int64), 0.0
+                for statement, statement_hashes in stored.items():
+                    statement_hashes = np.array(statement_hashes, dtype=np.int64)
+                    share = _overlap(fingerprint_keys(statement_hashes), current_keys)
+                    if share >= self.overlap and share > best:
+                        restated, restated_hashes, best = statement, statement_hashes, share
+
+                parts.extend(self._diff_statement(conn, df.iloc[positions], current, restated_hashes, restated))
+                self._store_statement(conn, df.iloc[positions], current, digest, deal_date, broker,
+                                      restated or uuid.uuid4().hex)
+
+        if not parts:
+            return df.iloc[:0].assign(change=pd.Series(dtype=object))
+        changes = concat_trades(parts, ignore_index=True)
+        for change, n in changes['change'].value_counts().items():
+            count(f'dedup_{change.lower()}_rows', n)
+        return changes
+
+    def _diff_statement(self, conn, current_rows, current, stored, statement):
+        """Split one file's rows for a scope into NEW, CHANGED, REPLACED and CANCELLED rows."""
+        # Rows with identical content are unchanged, counting duplicates as separate fills
+        current_keys = fingerprint_keys(current)
+        stored_keys = fingerprint_keys(stored)
+        added = current_rows[~current_keys.isin(stored_keys)]
+        removed_mask = ~stored_keys.isin(current_keys)
+
+        removed = current_rows.iloc[:0]
+        if removed_mask.any():
+            # Stored rows come back in the order their hashes were read
+            rows = [row_json for (row_json,), is_removed in zip(conn.execute(
+                'SELECT row_json FROM trade_fingerprints WHERE statement = ? ORDER BY rowid', (statement,)
+            ), removed_mask) if is_removed]
+            removed = normalize_broker_trades(
+                pd.read_json(StringIO('\n'.join(rows)), lines=True, dtype=False, convert_dates=False)
+            )
+
+        # Pair what was added and removed by instrument and side: those are restated fills
+        pair_columns = [c for c in PAIR_COLUMNS if c in current_rows.columns]
+        added_pairs = added[pair_columns].astype(str).assign(_n=_occurrences(added, pair_columns))
+        removed_pairs = removed[pair_columns].astype(str).assign(_n=_occurrences(removed, pair_columns))
+        paired_added = pd.MultiIndex.from_frame(added_pairs).isin(pd.MultiIndex.from_frame(removed_pairs))
+        paired_removed = pd.MultiIndex.from_frame(removed_pairs).isin(pd.MultiIndex.from_frame(added_pairs))
+
+        return [part for part in (
+            added[~paired_added].assign(change='NEW'),
+            added[paired_added].assign(change='CHANGED'),
+            removed[paired_removed].assign(change='REPLACED'),
+            removed[~paired_removed].assign(change='CANCELLED'),
+        ) if not part.empty]
+
+    @staticmethod
+    def _store_statement(conn, rows, hashes, digest, deal_date, broker, statement):
+        """Store rows as the current version of a file's statement for one scope."""
+        conn.execute('INSERT OR REPLACE INTO trade_statements (deal_date, broker, statement, digest) VALUES (?, ?, ?, ?)',
+                     (deal_date, broker, statement, digest))
+        conn.execute('DELETE FROM trade_fingerprints WHERE statement = ?', (statement,))
+        row_json = rows.to_json(orient='records', lines=True, date_format='iso', double_precision=15).splitlines()
+        conn.executemany(
+            'INSERT INTO trade_fingerprints (deal_date, broker, statement, content_hash, row_json) '
+            'VALUES (?, ?, ?, ?, ?)',
+            ((deal_date, broker, statement, int(h), j) for h, j in zip(hashes, row_json))
+        )
@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from instrumentation import timed
+
+# Column layout of the broker TradeFile*.xlsx attachments (see broker_trades.csv)
+BROKER_FILE_COLUMNS = [
+    'Deal Date', 'party code/SEBI regn code of party', 'Instrument ISIN', 'Buy/Sell Flag',
+    'QTY', 'COST', 'Col 8', 'NET AMOUNT', 'Brokerage Amount', 'Settlement Date',
+    'STT', 'Exchange Code', 'Depository Code'
+]
+
+# Repetitive text columns of the broker trade files, stored as categoricals
+BROKER_CATEGORICAL_COLUMNS = [
+    'party code/SEBI regn code of party', 'Instrument ISIN', 'Buy/Sell Flag',
+    'Exchange Code', 'Depository Code'
+]
+BROKER_DATE_COLUMNS = ['Deal Date', 'Settlement Date']
+BROKER_QUANTITY_COLUMNS = ['QTY']
+# Rupee amounts stay float64: float32 keeps only ~7 significant digits, which
+# would round NET AMOUNT values in the tens of millions
+BROKER_AMOUNT_COLUMNS = ['COST', 'NET AMOUNT', 'Brokerage Amount', 'STT']
+
+# Columns used for matching, normalized the same way on both sides
+MATCH_CATEGORICAL_COLUMNS = ['Ticker', 'Direction']
+MATCH_DATE_COLUMNS = ['Date']
+MATCH_QUANTITY_COLUMNS = ['Quantity']
+
+# Matching columns and the broker file columns they are taken from
+MATCHING_COLUMN_SOURCES = {
+    'Ticker': 'Instrument ISIN',
+    'Direction': 'Buy/Sell Flag',
+    'Date': 'Deal Date',
+    'Quantity': 'QTY',
+    'Net Amount': 'NET AMOUNT',
+}
+
+# Columns TradeReconciliation needs on the client orders
+CLIENT_ORDER_COLUMNS = ['UCC', 'Ticker', 'Quantity', 'Direction', 'Date']
+
+def _to_category(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series
+    return series.astype('category')
+
+def _to_datetime(series):
+    """Parse dates, leaving the column untouched if any value is not a date."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    try:
+        return pd.to_datetime(series)
+    except (ValueError, TypeError):
+        return series
+
+def _to_compact_int(series):
+    """
+    Downcast whole-number quantities, never below int32 so running totals
+    in the matching loop cannot overflow.
+    """
+    if not pd.api.types.is_numeric_dtype(series) or series.isna().any():
+        return series
+    values = series.to_numpy()
+    if not np.array_equal(values, np.round(values)):
+        return series
+    if values.size and (values.min() < np.iinfo(np.int32).min or values.max() > np.iinfo(np.int32).max):
+        return series.astype('int64')
+    return series.astype('int32')
+
+def _to_float(series):
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype('float64')
+    return series
+
+def _normalize(df, categorical, dates, quantities, amounts=()):
+    df = df.copy()
+    for column in categorical:
+        if column in df.columns:
+            df[column] = _to_category(df[column])
+    for column in dates:
+        if column in df.columns:
+            df[column] = _to_datetime(df[column])
+    for column in quantities:
+        if column in df.columns:
+            df[column] = _to_compact_int(df[column])
+    for column in amounts:
+        if column in df.columns:
+            df[column] = _to_float(df[column])
+    return df
+
+def normalize_broker_trades(df):
+    """
+    Cast a freshly loaded broker trade file to its compact typed form:
+    categoricals for codes, datetime64 for dates and compact integers for quantities.
+    """
+    return _normalize(
+        df,
+        BROKER_CATEGORICAL_COLUMNS + MATCH_CATEGORICAL_COLUMNS,
+        BROKER_DATE_COLUMNS + MATCH_DATE_COLUMNS,
+        BROKER_QUANTITY_COLUMNS + MATCH_QUANTITY_COLUMNS,
+        BROKER_AMOUNT_COLUMNS,
+    )
+
+def normalize_client_orders(df):
+    """Cast client orders to the same compact types as the broker matching columns."""
+    return _normalize(df, MATCH_CATEGORICAL_COLUMNS, MATCH_DATE_COLUMNS, MATCH_QUANTITY_COLUMNS)
+
+@timed('concat')
+def concat_trades(frames, **kwargs):
+    """
+    Concatenate trade frames without losing categoricals.
+    pd.concat falls back to object dtype when categories differ between
+    frames, so categories are unioned first.
+    """
+    frames = [df for df in frames if df is not None]
+    if len(frames) > 1:
+        frames = [df.copy() for df in frames]
+        for column in frames[0].columns:
+            columns = [df[column] for df in frames if column in df.columns]
+            if len(columns) == len(frames) and all(isinstance(c.dtype, pd.CategoricalDtype) for c in columns):
+                try:
+                    categories = union_categoricals(columns).categories
+                except TypeError:
+                    continue  # Categories of different types, leave it to pd.concat
+                for df in frames:
+                    df[column] = df[column].cat.set_categories(categories)
+    return pd.concat(frames, **kwargs)
+
+def to_matching_layout(broker_trades_df):
+    """
+    Add the columns TradeReconciliation matches on to broker trades in the
+    broker file layout: ISIN as Ticker, Buy/Sell Flag as Direction, Deal Date
+    as Date, QTY as Quantity and NET AMOUNT as Net Amount. Broker files carry
+    no trade id, so UCC is set to the row number (T0, T1, ...) when missing.
+    Columns already present are kept. Raises ValueError if neither a matching
+    column nor its broker file column is present.
+    """
+    missing = [f'{target} (or {source})' for target, source in MATCHING_COLUMN_SOURCES.items()
+               if target not in broker_trades_df.columns and source not in broker_trades_df.columns]
+    if missing:
+        raise ValueError(f"Broker trades cannot be matched, missing columns: {', '.join(missing)}")
+
+    df = broker_trades_df.copy()
+    if 'UCC' not in df.columns:
+        df['UCC'] = [f'T{i}' for i in range(len(df))]
+    for target, source in MATCHING_COLUMN_SOURCES.items():
+        if target not in df.columns:
+            df[target] = df[source]
+    return df
+
+def check_client_orders(client_orders_df):
+    """Raise ValueError if client orders lack a column TradeReconciliation needs."""
+    missing = [c for c in CLIENT_ORDER_COLUMNS if c not in client_orders_df.columns]
+    if missing:
+        raise ValueError(f"Client orders cannot be matched, missing columns: {', '.join(missing)}")
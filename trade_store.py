@@ -0,0 +1,278 @@
+import logging
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import count, timed
+
+logger = logging.getLogger(__name__)
+
+TABLES = ('broker_trades', 'results')
+STORE_EXTENSION = '.arrow'
+
+# Hidden column of broker trade parts holding each row's fingerprint
+FINGERPRINT_COLUMN = '_fingerprint'
+
+# Column each query filter applies to, per table
+FILTER_COLUMNS = {
+    'broker_trades': {
+        'date': 'Deal Date',
+        'broker': 'party code/SEBI regn code of party',
+        'isin': 'Instrument ISIN',
+        'status': None,
+    },
+    'results': {
+        'date': None,
+        'broker': None,
+        'isin': 'symbol',
+        'status': 'status',
+    },
+}
+
+def _require_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise ImportError("The trade store requires pyarrow (pip install pyarrow)")
+
+def _date_key(value):
+    return pd.Timestamp(value).strftime('%Y-%m-%d')
+
+def _trade_fingerprints(broker_trades):
+    """Row fingerprints over the broker file columns, or every column for other layouts."""
+    from trade_dedup import row_fingerprints
+    from trade_schema import BROKER_FILE_COLUMNS
+
+    columns = [c for c in BROKER_FILE_COLUMNS if c in broker_trades.columns]
+    return row_fingerprints(broker_trades, columns or [c for c in broker_trades.columns if c != FINGERPRINT_COLUMN])
+
+def _row_dates(df, row_column, frame, *date_columns):
+    """Date of the frame row each result row points at, NaT where it has none."""
+    column = next((c for c in date_columns if c in frame.columns), None)
+    if row_column not in df.columns or column is None:
+        return pd.Series(pd.NaT, index=df.index)
+    rows = pd.to_numeric(df[row_column]).fillna(-1).to_numpy(dtype=int)
+    dates = np.append(pd.to_datetime(frame[column]).to_numpy(dtype='datetime64[ns]'), np.datetime64('NaT'))
+    return pd.Series(dates[rows], index=df.index)
+
+class TradeAppender:
+    """
+    Appends the broker trades of one run to a TradeStore, skipping rows that
+    are already stored. Rows are compared by fingerprint per deal date as a
+    multiset: a run holding a fill k times adds only the copies beyond those
+    stored, so appending the same trades again, whole or in chunks, adds nothing.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._stored = {}  # date key -> (fingerprint, occurrence) keys stored before this run
+        self._seen = {}    # date key -> fingerprints appended in this run
+
+    def _stored_keys(self, date_key):
+        from trade_dedup import fingerprint_keys
+
+        if date_key not in self._stored:
+            hashes = [self.store._part_fingerprints(part)
+                      for part in self.store._read_partition('broker_trades', date_key)]
+            self._stored[date_key] = fingerprint_keys(np.concatenate(hashes) if hashes else np.array([], dtype=np.int64))
+            self._seen[date_key] = np.array([], dtype=np.int64)
+        return self._stored[date_key]
+
+    @timed('store.append')
+    def append(self, broker_trades):
+        """Append the rows not stored yet, one part per Deal Date. Returns the written paths."""
+        from trade_dedup import fingerprint_keys
+
+        date_column = FILTER_COLUMNS['broker_trades']['date']
+        dates = pd.to_datetime(broker_trades[date_column])
+        paths = []
+        appended = 0
+        for day, part in broker_trades.groupby(dates.dt.normalize(), sort=True):
+            date_key = _date_key(day)
+            stored = self._stored_keys(date_key)
+            hashes = _trade_fingerprints(part)
+            # Rows are numbered among the identical rows of the whole run, not just this chunk
+            seen = np.concatenate([self._seen[date_key], hashes])
+            keep = ~fingerprint_keys(seen)[len(self._seen[date_key]):].isin(stored)
+            self._seen[date_key] = seen
+            if keep.any():
+                new_rows = part[keep].assign(**{FINGERPRINT_COLUMN: hashes[keep]})
+                paths.append(self.store._write_part('broker_trades', date_key, new_rows))
+                appended += int(keep.sum())
+        count('store.trade_rows', appended)
+        count('store.duplicate_rows', len(broker_trades) - appended)
+        return paths
+
+class TradeStore:
+    """
+    Append-only columnar store of broker trades and reconciliation results
+    under store_dir/<table>/deal_date=YYYY-MM-DD/<part>.arrow. Parts are
+    uncompressed Arrow IPC files, so queries memory-map them and only copy the
+    rows that pass the filters. Partitions outside a query's date range are
+    never opened. Appends are idempotent: broker trades already stored are
+    skipped, and results replace the earlier results of their deal dates.
+    """
+
+    def __init__(self, store_dir):
+        _require_pyarrow()
+        self.store_dir = store_dir
+
+    def _partition_dir(self, table, date_key):
+        return os.path.join(self.store_dir, table, f'deal_date={date_key}')
+
+    def _write_part(self, table, date_key, df):
+        """Write one immutable part file; the rename makes it visible atomically."""
+        import pyarrow as pa
+
+        directory = self._partition_dir(table, date_key)
+        os.makedirs(directory, exist_ok=True)
+        name = f'part-{pd.Timestamp.now():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}{STORE_EXTENSION}'
+        path = os.path.join(directory, name)
+        tmp_path = path + '.tmp'
+
+        arrow_table = pa.Table.from_pandas(df.reset_index(drop=True), preserve_index=False)
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, arrow_table.schema) as writer:
+                writer.write_table(arrow_table)
+        os.replace(tmp_path, path)
+        return path
+
+    def trade_appender(self):
+        """Return a TradeAppender for appending one run's broker trades in several chunks."""
+        return TradeAppender(self)
+
+    def append_trades(self, broker_trades):
+        """
+        Append the broker trades not stored yet, one part per Deal Date.
+        Returns the written paths.
+        """
+        return self.trade_appender().append(broker_trades)
+
+    @timed('store.append')
+    def append_results(self, results, broker_trades, client_orders, replace=True):
+        """
+        Append the matched, unmatched and excess frames of a TradeReconciliation
+        get_results() on client_orders and broker_trades, one part per deal date:
+        the date of the trade a row was filled from, or of its order. With
+        replace, the results are the full reconciliation of their deal dates
+        and replace the results stored for them before; the new part is written
+        before the old ones are removed. Incremental runs, whose results only
+        add to earlier ones, pass replace=False. Returns the written paths.
+        """
+        from matching_engine import ROW_COLUMNS
+
+        frames = [results[name] for name in ('matched', 'unmatched', 'excess')
+                  if results.get(name) is not None and not results[name].empty]
+        if not frames:
+            return []
+        combined = pd.concat(frames, ignore_index=True)
+        dates = _row_dates(combined, 'trade_row', broker_trades, 'Date', 'Deal Date')
+        dates = dates.fillna(_row_dates(combined, 'order_row', client_orders, 'Date'))
+        if dates.isna().any():
+            logger.warning("%d results have no deal date and are not stored", int(dates.isna().sum()))
+
+        # Row positions refer to the reconciled frames only
+        combined = combined.drop(columns=ROW_COLUMNS, errors='ignore')
+        # Mixed object columns (ids may be None) are stored as strings
+        for column in ('order_id', 'trade_id', 'symbol', 'status'):
+            if column in combined.columns:
+                combined[column] = combined[column].astype('string')
+
+        paths = []
+        for day, part in combined.groupby(dates.dt.normalize(), sort=True):
+            date_key = _date_key(day)
+            directory = self._partition_dir('results', date_key)
+            earlier = os.listdir(directory) if replace and os.path.isdir(directory) else []
+            path = self._write_part('results', date_key, part)
+            for name in earlier:
+                if name.endswith(STORE_EXTENSION):
+                    os.remove(os.path.join(directory, name))
+            paths.append(path)
+        count('store.result_rows', int(dates.notna().sum()))
+        return paths
+
+    def partitions(self, table, start_date=None, end_date=None):
+        """Return the deal dates stored for table within [start_date, end_date]."""
+        root = os.path.join(self.store_dir, table)
+        if not os.path.isdir(root):
+            return []
+        start = _date_key(start_date) if start_date is not None else None
+        end = _date_key(end_date) if end_date is not None else None
+
+        dates = []
+        for entry in os.scandir(root):
+            if not entry.is_dir() or not entry.name.startswith('deal_date='):
+                continue
+            date_key = entry.name.split('=', 1)[1]
+            # ISO dates compare correctly as strings
+            if (start is None or date_key >= start) and (end is None or date_key <= end):
+                dates.append(date_key)
+        return sorted(dates)
+
+    @staticmethod
+    def _part_fingerprints(part):
+        """Row fingerprints of a broker trade part, computed for parts written without them."""
+        if FINGERPRINT_COLUMN in part.column_names:
+            return part[FINGERPRINT_COLUMN].to_numpy()
+        return _trade_fingerprints(part.to_pandas())
+
+    def _read_partition(self, table, date_key):
+        """Memory-map every part of a partition; returns Arrow tables without copying."""
+        import pyarrow as pa
+
+        directory = self._partition_dir(table, date_key)
+        if not os.path.isdir(directory):
+            return []
+        tables = []
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(STORE_EXTENSION):
+                source = pa.memory_map(os.path.join(directory, name), 'r')
+                tables.append(pa.ipc.open_file(source).read_all())
+        return tables
+
+    @timed('store.query')
+    def query(self, table='broker_trades', start_date=None, end_date=None, broker=None, isin=None, status=None,
+              columns=None):
+        """
+        Return the rows of table within the deal date range that match the
+        broker, ISIN and status filters (each a value or a list of values) as a
+        DataFrame. columns limits the columns read.
+        """
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        if table not in TABLES:
+            raise ValueError(f"Unknown table: {table}. Expected one of {TABLES}")
+
+        filters = []
+        for name, value in (('broker', broker), ('isin', isin), ('status', status)):
+            if value is None:
+                continue
+            column = FILTER_COLUMNS[table][name]
+            if column is None:
+                raise ValueError(f"The {table} table cannot be filtered by {name}")
+            filters.append((column, [value] if np.isscalar(value) else list(value)))
+
+        parts = []
+        for date_key in self.partitions(table, start_date, end_date):
+            for part in self._read_partition(table, date_key):
+                mask = None
+                for column, values in filters:
+                    condition = pc.is_in(part[column].cast(pa.string()), value_set=pa.array(values, pa.string()))
+                    mask = condition if mask is None else pc.and_(mask, condition)
+                if mask is not None:
+                    part = part.filter(mask)
+                if columns is not None:
+                    part = part.select(columns)
+                elif FINGERPRINT_COLUMN in part.column_names:
+                    part = part.drop_columns(FINGERPRINT_COLUMN)
+                if part.num_rows:
+                    parts.append(part)
+
+        if not parts:
+            return pd.DataFrame(columns=columns)
+        result = pa.concat_tables(parts, promote_options='default')
+        count('store.rows_read', result.num_rows)
+        return result.to_pandas()
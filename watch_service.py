@@ -0,0 +1,221 @@
+import argparse
+import asyncio
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+
+import pandas as pd
+
+from attachment_cache import AttachmentCache
+from extract_trades import extract_excel_from_email
+from matching_engine import ROW_COLUMNS
+from reconcile_trades import TradeReconciliation, INCREMENTAL_TRADE_COLUMNS, close_connections
+from report_generation import (calculate_costs, append_matched_trades_chunk,
+                               BrokerSummaryAccumulator, write_broker_summary)
+from trade_dedup import TradeDeduplicator, ADDED_CHANGES
+from trade_schema import CLIENT_ORDER_COLUMNS, check_client_orders, concat_trades, to_matching_layout
+from instrumentation import configure_logging
+
+logger = logging.getLogger(__name__)
+
+# Seconds between directory scans
+DEFAULT_POLL_INTERVAL = 2.0
+
+class ReconciliationService:
+    """
+    Long-running service that watches data_dir for new .eml files and folds
+    their trades into resident reconciliation state, refreshing the reports
+    in output_dir after every batch. Parsing runs in a process pool so the
+    event loop stays responsive.
+    """
+
+    def __init__(self, data_dir, output_dir, poll_interval=DEFAULT_POLL_INTERVAL, max_workers=None,
+                 cache_dir=None):
+        self.data_dir = data_dir
+        self.output_dir = output_dir
+        self.poll_interval = poll_interval
+        self.max_workers = max_workers
+        self.cache = AttachmentCache(cache_dir or os.path.join(data_dir, '.attachment_cache'))
+        self.state_db = os.path.join(output_dir, 'reconciliation_state.db')
+        # Resent and restated broker files only contribute what changed
+        self.dedup = TradeDeduplicator(os.path.join(output_dir, 'trade_fingerprints.db'))
+
+        # Resident state
+        self.processed = set()
+        self.pending_sizes = {}  # path -> (size, mtime) seen on the previous scan
+        self.client_orders = None
+        self.summary = BrokerSummaryAccumulator()
+        self.matched_columns = None
+        self.generated_at = None
+        self.total_trades = 0
+
+        self._stop = None
+
+    def _scan(self):
+        """
+        Return .eml files that are new and have stopped changing since the
+        previous scan, so partially written files are not picked up.
+        """
+        ready = []
+        current = {}
+        for entry in os.scandir(self.data_dir):
+            if not entry.is_file() or not entry.name.lower().endswith('.eml') or entry.path in self.processed:
+                continue
+            stat = entry.stat()
+            current[entry.path] = (stat.st_size, stat.st_mtime)
+            if self.pending_sizes.get(entry.path) == current[entry.path]:
+                ready.append((stat.st_mtime, entry.path))
+        self.pending_sizes = current
+        return [path for _, path in sorted(ready)]
+
+    def _reset_reports(self):
+        """Start the matched trades report afresh for this service run."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.generated_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        # Every file in data_dir is re-applied on start, so incremental state starts empty too;
+        # shared connections to the old state databases must not outlive their files
+        close_connections()
+        for name in ('matched_trades.csv', 'reconciliation_results.csv', 'reconciliation_state.db',
+                     'reconciliation_state.db-wal', 'reconciliation_state.db-shm', 'trade_fingerprints.db',
+                     'trade_fingerprints.db-wal', 'trade_fingerprints.db-shm'):
+            path = os.path.join(self.output_dir, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def apply(self, path, client_orders, broker_trades):
+        """Fold the trades of one parsed email into the resident state."""
+        self.processed.add(path)
+        self.pending_sizes.pop(path, None)
+
+        if client_orders:
+            new_orders = concat_trades(client_orders, ignore_index=True)
+            frames = [self.client_orders] if self.client_orders is not None else []
+            self.client_orders = concat_trades(frames + [new_orders], ignore_index=True)
+            logger.info("Loaded %d client order files from %s", len(client_orders), path)
+            # Fills delivered before these orders are already in the incremental state; replay them
+            try:
+                check_client_orders(new_orders)
+            except ValueError as e:
+                logger.error("Cannot reconcile the client orders of %s: %s", path, e)
+            else:
+                self._reconcile(new_orders, pd.DataFrame(columns=INCREMENTAL_TRADE_COLUMNS))
+
+        if not broker_trades:
+            return False
+
+        changes = self.dedup.diff(concat_trades(broker_trades, ignore_index=True))
+        if changes.empty:
+            logger.info("No new or changed trades in %s", path)
+            return False
+
+        # matched_trades.csv records every change; the totals add new versions and take back old ones
+        changes = calculate_costs(changes)
+        if self.matched_columns is None:
+            self.matched_columns = changes.columns.tolist()
+        append_matched_trades_chunk(changes, os.path.join(self.output_dir, 'matched_trades.csv'),
+                                    self.generated_at, columns=self.matched_columns)
+
+        added = changes['change'].isin(ADDED_CHANGES).to_numpy()
+        new_trades = changes[added]
+        if added.any():
+            self.summary.update(new_trades)
+        if not added.all():
+            self.summary.update(changes[~added], sign=-1)
+        self.total_trades += int(added.sum()) - int((~added).sum())
+
+        # Every fill is recorded in the incremental state, even before any client orders
+        # have arrived, so orders loaded later are matched against it. The earlier version
+        # of a changed or cancelled fill stays there, so only new fills are matched.
+        new_fills = changes[(changes['change'] == 'NEW').to_numpy()]
+        n_revised = int(changes['change'].isin(['CHANGED', 'CANCELLED']).sum())
+        if n_revised:
+            logger.warning("%d changed or cancelled trades in %s are not reconciled again; "
+                           "their earlier fills are kept", n_revised, path)
+        if not new_fills.empty:
+            try:
+                # Broker files come in their own layout; derive the columns orders are matched on
+                matching_trades = to_matching_layout(new_fills)
+            except ValueError as e:
+                logger.error("Cannot reconcile the trades of %s: %s", path, e)
+            else:
+                orders = self.client_orders if self.client_orders is not None else pd.DataFrame(columns=CLIENT_ORDER_COLUMNS)
+                self._reconcile(orders, matching_trades)
+
+        logger.info("Applied %d new or changed and %d replaced or cancelled trades from %s (%d total)",
+                    int(added.sum()), int((~added).sum()), path, self.total_trades)
+        return True
+
+    def _reconcile(self, client_orders, new_trades):
+        """
+        Match only the new trades against the open orders, or only newly loaded
+        orders against the trades applied so far, and append the resulting fills.
+        """
+        reconciler = TradeReconciliation(client_orders, new_trades, mode='incremental', state_db=self.state_db)
+        reconciler.reconcile()
+        results = reconciler.get_results()
+        fills = concat_trades([results['matched'], results['excess']], ignore_index=True)
+        # Row positions refer to this call's frames only
+        fills = fills.drop(columns=ROW_COLUMNS, errors='ignore')
+        if not fills.empty:
+            path = os.path.join(self.output_dir, 'reconciliation_results.csv')
+            fills.to_csv(path, mode='a', header=not os.path.exists(path), index=False)
+
+    def refresh_reports(self):
+        """Rewrite the (small) broker summary from the accumulated totals."""
+        write_broker_summary(self.summary.to_frame(), self.output_dir, self.generated_at)
+
+    async def _process(self, loop, executor, paths):
+        extract = partial(extract_excel_from_email, cache=self.cache)
+        results = await asyncio.gather(*(loop.run_in_executor(executor, extract, path) for path in paths))
+
+        changed = False
+        for path, (client_orders, broker_trades) in zip(paths, results):
+            if client_orders is None and broker_trades is None:
+                # Unreadable email, do not retry it on every scan
+                self.processed.add(path)
+                continue
+            changed = self.apply(path, client_orders, broker_trades) or changed
+
+        if changed:
+            self.refresh_reports()
+
+    async def run(self):
+        """Watch data_dir until stop() is called."""
+        self._stop = asyncio.Event()
+        self._reset_reports()
+        loop = asyncio.get_running_loop()
+        logger.info("Watching %s for broker emails", self.data_dir)
+
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            while not self._stop.is_set():
+                paths = self._scan()
+                if paths:
+                    await self._process(loop, executor, paths)
+                try:
+                    await asyncio.wait_for(self._stop.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+
+def main():
+    parser = argparse.ArgumentParser(description='Reconcile broker email files as they arrive in a directory.')
+    parser.add_argument('data_dir', help='directory the broker .eml files are delivered to')
+    parser.add_argument('output_dir', help='directory for the reports')
+    parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL, help='seconds between scans')
+    parser.add_argument('--workers', type=int, default=None, help='process pool size for parsing')
+    args = parser.parse_args()
+
+    configure_logging()
+    service = ReconciliationService(args.data_dir, args.output_dir, args.poll_interval, args.workers)
+    try:
+        asyncio.run(service.run())
+    except KeyboardInterrupt:
+        logger.info("Stopped watching %s", args.data_dir)
+
+if __name__ == "__main__":
+    main()
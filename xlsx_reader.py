@@ -0,0 +1,249 @@
+import html
+import logging
+import posixpath
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import count
+from trade_schema import BROKER_FILE_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PACKAGE_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+# One worksheet cell: reference, remaining attributes, then its value or inline
+# string if it has one. Formulas and rich-text strings are not matched, so
+# sheets containing them are left to pd.read_excel.
+CELL_PATTERN = re.compile(rb'<c r="([A-Z]+\d+)"([^>]*)>(?:<v>([^<]*)</v>|<is><t>([^<]*)</t></is>)?')
+ATTRIBUTE_PATTERN = re.compile(rb'\b([st])="([^"]*)"')
+TEXT_PATTERN = re.compile(rb'<t(?:\s[^>]*)?>([^<]*)</t>')
+SHARED_STRING_PATTERN = re.compile(rb'<si>(.*?)</si>', re.S)
+
+# Cell types handled by the fast path; anything else (booleans, errors, ISO dates) falls back
+NUMBER, SHARED, INLINE, FORMULA_STRING, UNSUPPORTED = range(5)
+CELL_TYPES = {b'': NUMBER, b'n': NUMBER, b's': SHARED, b'inlineStr': INLINE, b'str': FORMULA_STRING}
+
+# Built-in number formats that display dates or times
+BUILTIN_DATE_FORMATS = set(range(14, 23)) | set(range(27, 37)) | set(range(45, 48)) | set(range(50, 59))
+
+EXCEL_EPOCH = np.datetime64('1899-12-30', 'us')
+EXCEL_EPOCH_1904 = np.datetime64('1904-01-01', 'us')
+US_PER_DAY = 86_400_000_000
+
+class LayoutMismatch(Exception):
+    """The workbook is not a plain broker trade file the fast reader understands."""
+
+def _unescape(raw):
+    text = raw.decode('utf-8')
+    return html.unescape(text) if '&' in text else text
+
+def _text(raw):
+    """Decode the concatenated <t> runs of a shared string item, resolving XML entities."""
+    text = b''.join(TEXT_PATTERN.findall(raw)).decode('utf-8')
+    return html.unescape(text) if '&' in text else text
+
+def _first_sheet_path(archive):
+    workbook = ET.fromstring(archive.read('xl/workbook.xml'))
+    sheet = workbook.find(f'{MAIN_NS}sheets/{MAIN_NS}sheet')
+    if sheet is None:
+        raise LayoutMismatch('workbook has no sheets')
+    properties = workbook.find(f'{MAIN_NS}workbookPr')
+    date1904 = properties is not None and properties.get('date1904') in ('1', 'true')
+
+    rels = ET.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    for rel in rels.iter(f'{PACKAGE_REL_NS}Relationship'):
+        if rel.get('Id') == sheet.get(f'{REL_NS}id'):
+            target = rel.get('Target')
+            path = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+            return path, date1904
+    raise LayoutMismatch('first sheet not found in workbook relationships')
+
+def _date_styles(archive):
+    """Indexes of cell styles whose number format shows a date."""
+    try:
+        styles = ET.fromstring(archive.read('xl/styles.xml'))
+    except KeyError:
+        return set()
+
+    date_formats = set(BUILTIN_DATE_FORMATS)
+    for fmt in styles.iter(f'{MAIN_NS}numFmt'):
+        # Ignore quoted literals, escapes and [colour]/[condition] sections before looking for date tokens
+        code = re.sub(r'"[^"]*"|\\.|\[[^\]]*\]', '', fmt.get('formatCode', '')).lower()
+        if re.search(r'[dmyhs]', code):
+            date_formats.add(int(fmt.get('numFmtId')))
+
+    cell_xfs = styles.find(f'{MAIN_NS}cellXfs')
+    if cell_xfs is None:
+        return set()
+    return {i for i, xf in enumerate(cell_xfs) if int(xf.get('numFmtId', 0)) in date_formats}
+
+def _shared_strings(archive):
+    try:
+        raw = archive.read('xl/sharedStrings.xml')
+    except KeyError:
+        return np.array([], dtype=object)
+    return np.array([_text(item) for item in SHARED_STRING_PATTERN.findall(raw)], dtype=object)
+
+def _split_references(references):
+    """Column index (0 for A) and row number of single-letter cell references like b'M1024'."""
+    width = references.dtype.itemsize
+    chars = references.view(np.uint8).reshape(len(references), width)
+    if (chars[:, 0] < ord('A')).any() or (chars[:, 0] > ord('Z')).any() or \
+            ((chars[:, 1:] != 0) & ((chars[:, 1:] < ord('0')) | (chars[:, 1:] > ord('9')))).any():
+        raise LayoutMismatch('cell references beyond column Z')
+
+    rows = np.zeros(len(references), dtype=np.int64)
+    for position in range(1, width):
+        digits = chars[:, position]
+        present = digits != 0  # shorter references are NUL-padded
+        rows[present] = rows[present] * 10 + (digits[present] - ord('0'))
+    return chars[:, 0].astype(np.int64) - ord('A'), rows
+
+def _parse_cells(sheet, start):
+    """Split every cell of the sheet XML after start into parallel NumPy arrays."""
+    if b'<f' in sheet or sheet.count(b'<is>') != sheet.count(b'<is><t>'):
+        raise LayoutMismatch('formulas or rich-text strings')
+    cells = CELL_PATTERN.findall(sheet, start)
+    # A cell the pattern did not recognise would silently go missing, so insist on all of them
+    if len(cells) != sheet.count(b'<c ', start):
+        raise LayoutMismatch('unrecognised cell markup')
+    if not cells:
+        raise LayoutMismatch('no data rows')
+
+    # One 2-D conversion is much cheaper than unzipping a million tuples
+    table = np.array(cells, dtype=object)
+    columns, rows = _split_references(table[:, 0].astype('S'))
+
+    attribute_index, unique_attributes = pd.factorize(table[:, 1])
+    styles = np.zeros(len(unique_attributes), dtype=np.int64)
+    types = np.zeros(len(unique_attributes), dtype=np.int64)
+    for i, attrs in enumerate(unique_attributes):
+        parsed = dict(ATTRIBUTE_PATTERN.findall(attrs))
+        styles[i] = int(parsed.get(b's', 0))
+        types[i] = CELL_TYPES.get(parsed.get(b't', b''), UNSUPPORTED)
+
+    return (columns, rows, styles[attribute_index], types[attribute_index],
+            table[:, 2].astype('S'), table[:, 3])
+
+def _cell_strings(types, values, inline, shared):
+    """String value of each string cell in the selection."""
+    result = np.empty(len(types), dtype=object)
+
+    is_shared = types == SHARED
+    if is_shared.any():
+        result[is_shared] = shared[values[is_shared].astype(np.int64)]
+
+    is_inline = types == INLINE
+    if is_inline.any():
+        # Inline strings repeat heavily (broker codes, ISINs), so decode each distinct one once
+        index, unique_inline = pd.factorize(inline[is_inline])
+        result[is_inline] = np.array([_unescape(raw) for raw in unique_inline], dtype=object)[index]
+
+    is_formula = types == FORMULA_STRING
+    if is_formula.any():
+        result[is_formula] = [_unescape(v) for v in values[is_formula]]
+    return result
+
+def _build_column(n_rows, positions, styles, types, values, inline, shared, date_styles, epoch):
+    """Assemble one typed column the way pd.read_excel would type it."""
+    present = np.where(types == INLINE, inline != b'', values != b'')
+    positions, styles, types, values, inline = (a[present] for a in (positions, styles, types, values, inline))
+
+    is_number = types == NUMBER
+    if not is_number.all() and not (~is_number).all():
+        # Mixed numbers and text stay an object column
+        column = np.full(n_rows, np.nan, dtype=object)
+        numbers = values[is_number].astype(np.float64)
+        column[positions[is_number]] = [int(v) if v.is_integer() else v for v in numbers]
+        column[positions[~is_number]] = _cell_strings(types[~is_number], values[~is_number],
+                                                      inline[~is_number], shared)
+        return column
+
+    if len(positions) and not is_number.any():
+        column = np.full(n_rows, np.nan, dtype=object)
+        column[positions] = _cell_strings(types, values, inline, shared)
+        return column
+
+    numbers = values.astype(np.float64)
+    is_date = np.isin(styles, list(date_styles))
+    if is_date.any():
+        if not is_date.all():
+            raise LayoutMismatch('column mixes dates and numbers')
+        column = np.full(n_rows, np.datetime64('NaT'), dtype='datetime64[us]')
+        column[positions] = epoch + np.round(numbers * US_PER_DAY).astype(np.int64).astype('timedelta64[us]')
+        return column
+
+    if len(positions) == n_rows and np.array_equal(numbers, np.round(numbers)):
+        column = np.zeros(n_rows, dtype=np.int64)
+        column[positions] = numbers
+        return column
+
+    column = np.full(n_rows, np.nan)
+    column[positions] = numbers
+    return column
+
+def read_broker_xlsx(data):
+    """
+    Decode a broker trade .xlsx in the BROKER_FILE_COLUMNS layout straight
+    from the sheet XML into typed NumPy columns, without openpyxl.
+    Raises LayoutMismatch if the workbook is not in that layout.
+    """
+    try:
+        archive = zipfile.ZipFile(BytesIO(data))
+        sheet_path, date1904 = _first_sheet_path(archive)
+        sheet = archive.read(sheet_path)
+    except (zipfile.BadZipFile, KeyError, ET.ParseError) as e:
+        raise LayoutMismatch(f'not a readable xlsx workbook: {e}')
+
+    # Check the header row before decoding the whole sheet
+    header_end = sheet.find(b'</row>')
+    if header_end < 0:
+        raise LayoutMismatch('sheet has no rows')
+    shared = _shared_strings(archive)
+    header = []
+    for i, (reference, attrs, value, inline) in enumerate(CELL_PATTERN.findall(sheet, 0, header_end)):
+        kind = CELL_TYPES.get(dict(ATTRIBUTE_PATTERN.findall(attrs)).get(b't', b''), UNSUPPORTED)
+        if reference != f'{chr(ord("A") + i)}1'.encode() or kind not in (SHARED, INLINE):
+            raise LayoutMismatch('header is not a row of text cells')
+        header.append(shared[int(value)] if kind == SHARED else _unescape(inline))
+    if header != BROKER_FILE_COLUMNS:
+        raise LayoutMismatch('header does not match the broker trade file layout')
+
+    columns, rows, styles, types, values, inline = _parse_cells(sheet, header_end)
+    if (types == UNSUPPORTED).any():
+        raise LayoutMismatch('unsupported cell type')
+    if (columns >= len(BROKER_FILE_COLUMNS)).any() or (rows < 2).any():
+        raise LayoutMismatch('cells outside the broker trade file layout')
+
+    n_rows = int(rows.max()) - 1
+    date_styles = _date_styles(archive)
+    epoch = EXCEL_EPOCH_1904 if date1904 else EXCEL_EPOCH
+
+    # Group cells by column once instead of masking the arrays per column
+    order = np.argsort(columns, kind='stable')
+    bounds = np.searchsorted(columns[order], np.arange(len(BROKER_FILE_COLUMNS) + 1))
+
+    frame = {}
+    for i, name in enumerate(BROKER_FILE_COLUMNS):
+        selected = order[bounds[i]:bounds[i + 1]]
+        frame[name] = _build_column(n_rows, rows[selected] - 2, styles[selected], types[selected],
+                                    values[selected], inline[selected], shared, date_styles, epoch)
+    return pd.DataFrame(frame, columns=BROKER_FILE_COLUMNS)
+
+def read_excel(data):
+    """Read attachment bytes with the fast broker reader, falling back to pd.read_excel."""
+    try:
+        df = read_broker_xlsx(data)
+        count('xlsx_fast_path')
+        return df
+    except LayoutMismatch as e:
+        logger.debug("Fast xlsx reader not applicable (%s); using pd.read_excel", e)
+        count('xlsx_fallback')
+        return pd.read_excel(BytesIO(data))